@@ -0,0 +1,101 @@
+"""Benchmarks the on-disk size and read throughput of plain artifact files
+versus zstd compressed ones, with and without a trained dictionary.
+
+    $ python benchmarks/bench_artifacts.py -n 5000
+    $ python benchmarks/bench_artifacts.py --root ~/libcfgraph/artifacts -n 5000
+"""
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from libcflib import store
+from libcflib.walker import walk_artifact_paths
+
+
+def make_artifact(rng, i):
+    name = f"pkg{i}"
+    return {
+        "name": name,
+        "version": f"1.{i}",
+        "about": {"license": "BSD-3-Clause", "summary": f"The {name} package"},
+        "index": {
+            "build": "py_0",
+            "depends": [f"dep{rng.randrange(1000)} >=1.0" for _ in range(8)],
+            "subdir": "noarch",
+        },
+        "files": [
+            f"site-packages/{name}/{sub}/mod{j}.py"
+            for sub in ["", "core", "io", "tests"]
+            for j in range(rng.randrange(50))
+        ],
+    }
+
+
+def copy_sample(src, dst, n):
+    paths = list(walk_artifact_paths(src))
+    for path in random.Random(42).sample(paths, min(n, len(paths))):
+        filename = os.path.join(dst, path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "wb") as f:
+            f.write(store.read_artifact_bytes(src, path))
+
+
+def make_corpus(dst, n):
+    rng = random.Random(42)
+    for i in range(n):
+        filename = os.path.join(dst, store.artifact_path(f"pkg{i}", "conda-forge", "noarch", f"pkg{i}-1.{i}-py_0"))
+        os.makedirs(os.path.dirname(filename))
+        store.dump_artifact(make_artifact(rng, i), filename)
+
+
+def corpus_size(root):
+    return sum(
+        os.path.getsize(os.path.join(d, f))
+        for d, _, files in os.walk(root)
+        if os.path.basename(d) != store.DICTS_DIRNAME
+        for f in files
+    )
+
+
+def bench_reads(root):
+    paths = list(walk_artifact_paths(root))
+    store.DICTIONARIES.clear()
+    t0 = time.perf_counter()
+    for path in paths:
+        store.load_artifact(root, path)
+    return len(paths) / (time.perf_counter() - t0)
+
+
+def main(args=None):
+    p = argparse.ArgumentParser()
+    p.add_argument("--root", help="existing artifacts directory to sample from")
+    p.add_argument("-n", type=int, default=2000, help="number of artifacts")
+    ns = p.parse_args(args)
+    with tempfile.TemporaryDirectory() as d:
+        plain = os.path.join(d, "plain")
+        if ns.root:
+            copy_sample(ns.root, plain, ns.n)
+        else:
+            make_corpus(plain, ns.n)
+        nodict = os.path.join(d, "zstd")
+        shutil.copytree(plain, nodict)
+        store.compress_directory(nodict)
+        withdict = os.path.join(d, "zstd-dict")
+        shutil.copytree(plain, withdict)
+        store.train_dictionary(withdict, seed=42)
+        store.compress_directory(withdict)
+        base = corpus_size(plain)
+        for label, root in [("plain", plain), ("zstd", nodict), ("zstd+dict", withdict)]:
+            size = corpus_size(root)
+            rate = bench_reads(root)
+            print(
+                f"{label:>10}: {size / 2**20:8.1f} MiB ({size / base:6.1%}), "
+                f"{rate:8.0f} artifacts/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmarks the peak memory and time of reading repodata, by loading the
+whole file with ``json.load`` versus streaming it with
+``libcflib.repodata.iter_repodata``.
+
+Each reader runs in its own subprocess, so that peak RSS is measured cleanly.
+
+    $ python benchmarks/bench_repodata.py -n 300000
+"""
+import os
+import sys
+import bz2
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+
+
+def make_repodata(filename, n):
+    rng = random.Random(42)
+    with bz2.open(filename, "wt") as f:
+        f.write('{"info": {"subdir": "linux-64"}, "packages": {')
+        for i in range(n):
+            name = f"pkg{i % 5000}"
+            fn = f"{name}-1.{i}-py_{rng.randrange(100)}.tar.bz2"
+            info = {
+                "name": name,
+                "version": f"1.{i}",
+                "build": "py_0",
+                "build_number": 0,
+                "depends": [f"dep{rng.randrange(1000)} >=1.0" for _ in range(8)],
+                "license": "BSD-3-Clause",
+                "md5": "%032x" % rng.getrandbits(128),
+                "sha256": "%064x" % rng.getrandbits(256),
+                "size": rng.randrange(10**8),
+                "subdir": "linux-64",
+                "timestamp": 1600000000000 + i,
+            }
+            f.write(("," if i else "") + json.dumps(fn) + ":" + json.dumps(info))
+        f.write('}, "packages.conda": {}, "repodata_version": 1}')
+
+
+def run(mode, filename):
+    # imported in both modes, so that they start from the same baseline
+    from libcflib.repodata import iter_repodata
+
+    t0 = time.perf_counter()
+    if mode == "json":
+        with bz2.open(filename, "rt") as f:
+            repodata = json.load(f)
+        n = sum(1 for _ in repodata["packages"].items())
+    else:
+        with bz2.open(filename, "rt") as f:
+            n = sum(1 for _ in iter_repodata(f))
+    t1 = time.perf_counter()
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024
+    print(json.dumps({"mode": mode, "n": n, "seconds": t1 - t0, "peak_rss_mib": rss / 1024}))
+
+
+def main(args=None):
+    p = argparse.ArgumentParser()
+    p.add_argument("-n", type=int, default=200_000, help="number of packages")
+    p.add_argument("--run", choices=["json", "stream"], help=argparse.SUPPRESS)
+    p.add_argument("--filename", help=argparse.SUPPRESS)
+    ns = p.parse_args(args)
+    if ns.run:
+        run(ns.run, ns.filename)
+        return
+    with tempfile.TemporaryDirectory() as d:
+        filename = os.path.join(d, "repodata.json.bz2")
+        make_repodata(filename, ns.n)
+        print(f"repodata.json.bz2: {os.path.getsize(filename) / 2**20:.1f} MiB")
+        for mode in ["json", "stream"]:
+            out = subprocess.run(
+                [sys.executable, __file__, "--run", mode, "--filename", filename],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            res = json.loads(out.splitlines()[-1])
+            print(
+                f"{mode:>6}: {res['n']} packages in {res['seconds']:.2f} s, "
+                f"peak RSS {res['peak_rss_mib']:.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
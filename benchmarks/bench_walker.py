@@ -0,0 +1,59 @@
+"""Benchmarks walking an artifacts directory with per-package globs, as the
+indexer and reaper used to, versus ``libcflib.walker.walk_artifacts`` with one
+and with several threads.
+
+    $ python benchmarks/bench_walker.py -p 5000 -a 20
+    $ python benchmarks/bench_walker.py --root ~/libcfgraph/artifacts
+"""
+import os
+import glob
+import time
+import argparse
+import tempfile
+
+from libcflib.walker import walk_artifacts
+
+
+def make_tree(root, n_pkgs, n_artifacts):
+    for i in range(n_pkgs):
+        d = os.path.join(root, f"pkg{i}", "conda-forge", "linux-64")
+        os.makedirs(d)
+        for j in range(n_artifacts):
+            with open(os.path.join(d, f"pkg{i}-1.{j}-0.json"), "w") as f:
+                f.write("{}")
+
+
+def walk_glob(root):
+    for p in os.listdir(root):
+        yield from glob.glob(f"{root}/{p}/*/*/*.json")
+
+
+def bench(root):
+    walkers = [
+        ("glob", lambda: walk_glob(root)),
+        ("scandir x1", lambda: walk_artifacts(root, max_workers=1)),
+        ("scandir x16", lambda: walk_artifacts(root, max_workers=16)),
+    ]
+    for label, walker in walkers:
+        t0 = time.perf_counter()
+        n = sum(1 for _ in walker())
+        t1 = time.perf_counter()
+        print(f"{label:>12}: {n} artifacts in {t1 - t0:.2f} s")
+
+
+def main(args=None):
+    p = argparse.ArgumentParser()
+    p.add_argument("--root", help="existing artifacts directory to walk")
+    p.add_argument("-p", type=int, default=2000, help="number of packages")
+    p.add_argument("-a", type=int, default=20, help="artifacts per package")
+    ns = p.parse_args(args)
+    if ns.root:
+        bench(ns.root)
+        return
+    with tempfile.TemporaryDirectory() as d:
+        make_tree(d, ns.p, ns.a)
+        bench(d)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""Building and updating the channel graphs from the artifacts.
+
+Each artifact contributes its version, its arch and its requirements to the
+node of its package in the graph of its channel, and its arch to the edge
+from each of its requirements to its package. A ``GraphState`` counts these
+contributions, so that artifacts can be added, changed and removed one at a
+time, with a node or edge attribute only going away when the last artifact
+contributing it does. States are pickled between runs, so that an update
+only reads the artifacts that changed.
+
+Artifacts are read in shards by worker processes, and their contributions
+are counted in the main process as the shards complete.
+"""
+import os
+import time
+import pickle
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+import tqdm
+
+from libcflib.logger import LOGGER
+from libcflib.store import artifact_stamp, iter_artifact_paths, load_artifact
+from libcflib.versionorder import argsort_artifacts
+
+NODE_ATTRS = ("versions", "archs", "req")
+
+
+def artifact_requirements(art):
+    """The names of the packages in the rendered recipe requirements of an
+    artifact, from all of the requirement sections.
+    """
+    req = set()
+    for sec, deps in art['rendered_recipe'].get('requirements', {}).items():
+        if deps is None:
+            continue
+        for dep in deps:
+            req.add(dep.split(' ')[0])
+    return req
+
+
+def artifact_contribution(art):
+    """What an artifact's data contributes to the graph, ``(version, req)``."""
+    return art['version'], tuple(sorted(artifact_requirements(art)))
+
+
+def _count(counter, key, n):
+    counter[key] += n
+    if counter[key] <= 0:
+        del counter[key]
+
+
+class GraphState:
+    """Counted contributions of artifacts to the channel graphs.
+
+    ``contributions`` maps each artifact path to its ``(version, req)``.
+    ``channels`` maps each channel to ``(nodes, edges)``, where ``nodes``
+    maps package names to a Counter for each of ``NODE_ATTRS`` and ``edges``
+    maps ``(dep, pkg)`` to a Counter of arches. ``dirty`` is the set of
+    channels that have changed since it was last cleared.
+    """
+
+    def __init__(self):
+        self.contributions = {}
+        self.channels = {}
+        self.dirty = set()
+
+    def __repr__(self):
+        return f"GraphState({len(self.contributions)} artifacts)"
+
+    def __len__(self):
+        return len(self.contributions)
+
+    def __contains__(self, path):
+        return path in self.contributions
+
+    def _apply(self, path, contribution, n):
+        pkg, channel, arch, _ = path.split(os.sep)
+        version, req = contribution
+        nodes, edges = self.channels.setdefault(channel, ({}, {}))
+        node = nodes.setdefault(pkg, {k: Counter() for k in NODE_ATTRS})
+        _count(node["versions"], version, n)
+        _count(node["archs"], arch, n)
+        for dep in req:
+            _count(node["req"], dep, n)
+            edge = edges.setdefault((dep, pkg), Counter())
+            _count(edge, arch, n)
+            if not edge:
+                del edges[(dep, pkg)]
+        # every artifact contributes an arch to its package
+        if not node["archs"]:
+            del nodes[pkg]
+            if not nodes:
+                del self.channels[channel]
+        self.dirty.add(channel)
+
+    def add(self, path, contribution):
+        """Adds, or replaces, the contribution of the artifact at ``path``."""
+        self.remove(path)
+        self.contributions[path] = contribution
+        self._apply(path, contribution, 1)
+
+    def remove(self, path):
+        """Removes the contribution of the artifact at ``path``, if it has one."""
+        contribution = self.contributions.pop(path, None)
+        if contribution is not None:
+            self._apply(path, contribution, -1)
+
+    def digraph(self, channel):
+        """Returns the ``DiGraph`` of a channel, with nodes and edges added in
+        sorted order, so that it does not depend on the order that the
+        artifacts were added in.
+        """
+        g = nx.DiGraph()
+        nodes, edges = self.channels.get(channel, ({}, {}))
+        for pkg in sorted(nodes):
+            g.add_node(pkg, **{k: set(nodes[pkg][k]) for k in NODE_ATTRS})
+        for (dep, pkg) in sorted(edges):
+            g.add_edge(dep, pkg, arch=set(edges[(dep, pkg)]))
+        return g
+
+    def to_digraphs(self, channels=None):
+        """Returns a dict of channel names to their ``DiGraph``, for all
+        channels or for just the given ones.
+        """
+        channels = sorted(self.channels if channels is None else channels)
+        return {c: self.digraph(c) for c in channels}
+
+    def save(self, filename):
+        """Writes the state to a file, atomically."""
+        tmp = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((self.contributions, self.channels), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """Reads a state written by ``save()``."""
+        state = cls()
+        with open(filename, "rb") as f:
+            state.contributions, state.channels = pickle.load(f)
+        return state
+
+
+def _map_shard(args):
+    """Reads the contributions of a shard of artifacts, returning those of
+    the ones that could be read, and the errors of the ones that could not.
+    This runs in worker processes.
+    """
+    root, paths = args
+    contributions = []
+    failed = []
+    for path in paths:
+        try:
+            contributions.append((path, artifact_contribution(load_artifact(root, path))))
+        except Exception as e:
+            failed.append((path, repr(e)))
+    return len(paths), contributions, failed
+
+
+def read_contributions(root, paths, max_workers=None, shard_size=1000, progress=True):
+    """Reads the contributions of artifacts in parallel.
+
+    Parameters
+    ----------
+    root : str
+        The artifacts directory.
+    paths : list of str
+        The artifacts to read, relative to ``root``.
+    max_workers : int or None, optional
+        Number of processes to read artifacts with. 1 reads them in this
+        process.
+    shard_size : int, optional
+        Number of artifacts that each worker task reads.
+    progress : bool, optional
+        Whether to show a progress bar.
+
+    Yields
+    ------
+    path : str
+        The artifact path.
+    contribution : tuple or None
+        The ``(version, req)`` of the artifact, or None if it could not be
+        read, which is logged.
+    """
+    shards = [(root, paths[i:i + shard_size]) for i in range(0, len(paths), shard_size)]
+    bar = tqdm.tqdm(total=len(paths), desc="reading artifacts", disable=not progress)
+    if max_workers == 1:
+        pool = None
+        results = map(_map_shard, shards)
+    else:
+        pool = ProcessPoolExecutor(max_workers=max_workers)
+        results = (f.result() for f in as_completed([pool.submit(_map_shard, s) for s in shards]))
+    try:
+        for n, contributions, failed in results:
+            yield from contributions
+            for path, err in failed:
+                LOGGER.log(f"failed to read {path}: {err}", category="graphs")
+                yield path, None
+            bar.update(n)
+    finally:
+        bar.close()
+        if pool is not None:
+            pool.shutdown()
+
+
+def _log_timings(msg, timings):
+    msg += " in " + ", ".join(f"{k} {v:.2f}s" for k, v in timings.items())
+    LOGGER.log(msg, category="graphs", data={"timings": timings})
+
+
+def build_graph_state(root, paths=None, max_workers=None, shard_size=1000, progress=True):
+    """Builds the graph state of all of the artifacts in a directory.
+
+    Parameters
+    ----------
+    root : str
+        The artifacts directory.
+    paths : list of str or None, optional
+        The artifacts to build the state from, relative to ``root``,
+        defaults to all of them.
+    max_workers, shard_size, progress :
+        See ``read_contributions()``.
+
+    Returns
+    -------
+    state : GraphState
+    """
+    timings = {}
+    t0 = time.monotonic()
+    if paths is None:
+        paths = sorted(iter_artifact_paths(root))
+    timings["list"] = time.monotonic() - t0
+    t0 = time.monotonic()
+    state = GraphState()
+    for path, contribution in read_contributions(root, paths, max_workers=max_workers,
+                                                 shard_size=shard_size, progress=progress):
+        if contribution is not None:
+            state.add(path, contribution)
+    timings["map-reduce"] = time.monotonic() - t0
+    _log_timings(f"counted {len(state)} of {len(paths)} artifacts", timings)
+    return state
+
+
+def update_graph_state(state, root, paths, max_workers=1, progress=False):
+    """Brings a graph state up to date with artifacts that have been added,
+    changed or removed, reading only those.
+
+    Parameters
+    ----------
+    state : GraphState
+        The state to update, in place. Its ``dirty`` set is updated with the
+        channels that changed.
+    root : str
+        The artifacts directory.
+    paths : iterable of str
+        The paths, relative to ``root``, of the artifacts that have changed.
+    max_workers, progress :
+        See ``read_contributions()``.
+
+    Returns
+    -------
+    state : GraphState
+    """
+    t0 = time.monotonic()
+    existing = []
+    for path in sorted(set(paths)):
+        if artifact_stamp(root, path) is None:
+            state.remove(path)
+        else:
+            existing.append(path)
+    for path, contribution in read_contributions(root, existing, max_workers=max_workers,
+                                                 progress=progress):
+        if contribution is None:
+            state.remove(path)
+        else:
+            state.add(path, contribution)
+    _log_timings(f"updated {len(existing)} artifacts", {"update": time.monotonic() - t0})
+    return state
+
+
+def build_channel_graphs(root, paths=None, max_workers=None, shard_size=1000, progress=True):
+    """Builds the graphs of all of the channels in an artifacts directory.
+    See ``build_graph_state()`` for the parameters.
+
+    Returns
+    -------
+    graphs : dict
+        Maps channel names to their ``DiGraph``.
+    """
+    state = build_graph_state(root, paths=paths, max_workers=max_workers,
+                              shard_size=shard_size, progress=progress)
+    t0 = time.monotonic()
+    graphs = state.to_digraphs()
+    _log_timings(f"built {len(graphs)} channel graphs", {"graphs": time.monotonic() - t0})
+    return graphs
+
+
+def select_latest_artifacts(frame, channels=('conda-forge',),
+                            arches=('linux-64', 'osx-64', 'win-64'),
+                            include_noarch=True):
+    """Picks the latest artifact of every package from a table of artifact
+    summaries, with the same preferences as ``Package.latest_artifact()``,
+    in one vectorized pass: the first of ``channels`` that a package has,
+    the first of ``arches`` that it has in that channel, plus noarch, and
+    then the latest version, build number, build string and path.
+
+    Parameters
+    ----------
+    frame : pandas.DataFrame
+        Artifact summaries, as from ``ArtifactIndex.summary_frame()``.
+    channels, arches, include_noarch :
+        See ``Package.latest_artifact()``.
+
+    Returns
+    -------
+    paths : pandas.Series
+        The path of the latest artifact of each package that has one, indexed
+        by package name.
+    """
+    df = frame[frame["version"].notna() & frame["channel"].isin(channels)]
+    channel_rank = df["channel"].map({c: i for i, c in enumerate(channels)})
+    df = df[channel_rank == channel_rank.groupby(df["pkg"]).transform("min")]
+    arch_rank = df["arch"].map({a: i for i, a in enumerate(arches)})
+    best_arch = arch_rank.groupby(df["pkg"]).transform("min")
+    keep = arch_rank.notna() & (arch_rank == best_arch)
+    if include_noarch:
+        keep |= df["arch"] == "noarch"
+    df = df[keep]
+    if len(df) == 0:
+        return pd.Series([], index=pd.Index([], name="pkg"), name="path", dtype=object)
+    pkg_codes, pkgs = pd.factorize(df["pkg"], sort=True)
+    order = argsort_artifacts(df["version"].to_numpy(), df["build_number"].fillna(0).to_numpy(),
+                              df["build"].fillna("").to_numpy(), df["path"].to_numpy(),
+                              groups=pkg_codes)
+    # the latest artifact of each package is the last one of its group
+    last = order[np.r_[pkg_codes[order][1:] != pkg_codes[order][:-1], True]]
+    return pd.Series(df["path"].to_numpy()[last], index=pd.Index(pkgs, name="pkg"), name="path")
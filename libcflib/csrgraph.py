@@ -0,0 +1,389 @@
+"""A compact binary format for the channel graphs.
+
+A graph is a directory of NumPy arrays, which are memory mapped when it is
+loaded, so that loading it only reads a small JSON header. Each time a graph
+is written, it goes into a new numbered directory, such as
+``conda-forge.csr.2``, and the ``conda-forge.csr`` symlink is then replaced
+to point to it, so that there is always a whole graph to read. The
+directories have:
+
+* ``meta.json`` has the format version, the arch names and the counts.
+* ``names.npy`` is the UTF-8 package names, sorted and concatenated, with
+  ``name_offsets.npy`` holding where each one starts (and the total length
+  at the end). Packages are identified by their index in this order.
+* ``node_arches.npy`` is a bitmask of the arches that each package has
+  artifacts for, where bit ``i`` is ``arches[i]`` from the meta.
+* ``out_indptr.npy``, ``out_indices.npy`` and ``out_arches.npy`` are the
+  compressed sparse rows of the edges from each package to the packages that
+  require it, with a bitmask of the arches of each edge, and the ``in_``
+  arrays are the same for the edges to each package from its requirements.
+
+Versions are only kept in the node-link JSON form of the graph.
+
+``CSRGraph`` also answers the questions that are asked of the graphs, such
+as the transitive dependencies of a package, and caches the answers.
+"""
+import os
+import json
+import shutil
+from collections import deque
+
+import numpy as np
+import zict
+
+CSR_SUFFIX = ".csr"
+CSR_FORMAT = 1
+MAX_ARCHES = 64
+ARRAYS = (
+    "names", "name_offsets", "node_arches",
+    "out_indptr", "out_indices", "out_arches",
+    "in_indptr", "in_indices", "in_arches",
+)
+
+
+def _csr(rows, cols, masks, n):
+    """Sorts edges into compressed sparse rows, returning the row pointers,
+    the column of each edge and the mask of each edge.
+    """
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, cols[order].astype(np.int32), masks[order]
+
+
+def _versions(dirname):
+    """The numbered directories of the versions of a graph, by number."""
+    parent, base = os.path.split(dirname)
+    prefix = base + "."
+    versions = {}
+    for name in os.listdir(parent):
+        number = name[len(prefix):]
+        if name.startswith(prefix) and number.isdigit():
+            versions[int(number)] = os.path.join(parent, name)
+    return versions
+
+
+def write_csr_graph(g, dirname):
+    """Writes a channel graph in the binary format, as a new version that the
+    ``dirname`` symlink is atomically replaced to point to. The previous
+    version is kept, for readers that have just resolved the link, and older
+    ones are removed. Readers that have them mapped keep reading them.
+
+    Parameters
+    ----------
+    g : networkx.DiGraph
+        The graph, with ``"archs"`` sets on its nodes and ``"arch"`` sets on
+        its edges, as from ``channel_graphs.GraphState``.
+    dirname : str
+        The graph to write, conventionally ``<channel>.csr`` next to the
+        node-link JSON.
+    """
+    names = sorted(g.nodes)
+    ids = {name: i for i, name in enumerate(names)}
+    arches = set()
+    for _, archs in g.nodes(data="archs"):
+        arches.update(archs or ())
+    for _, _, archs in g.edges(data="arch"):
+        arches.update(archs or ())
+    arches = sorted(arches)
+    if len(arches) > MAX_ARCHES:
+        raise ValueError(f"graphs may only have {MAX_ARCHES} arches, got {len(arches)}")
+    bits = {arch: 1 << i for i, arch in enumerate(arches)}
+
+    def mask(archs):
+        return sum(bits[a] for a in archs or ())
+
+    encoded = [name.encode("utf-8") for name in names]
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    edges = list(g.edges(data="arch"))
+    src = np.array([ids[u] for u, _, _ in edges], dtype=np.int64)
+    dst = np.array([ids[v] for _, v, _ in edges], dtype=np.int64)
+    masks = np.array([mask(a) for _, _, a in edges], dtype=np.uint64)
+    n = len(names)
+    arrays = {
+        "names": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "name_offsets": offsets,
+        "node_arches": np.array([mask(g.nodes[name].get("archs")) for name in names], dtype=np.uint64),
+    }
+    for prefix, rows, cols in [("out", src, dst), ("in", dst, src)]:
+        indptr, indices, edge_masks = _csr(rows, cols, masks, n)
+        arrays[prefix + "_indptr"] = indptr
+        arrays[prefix + "_indices"] = indices
+        arrays[prefix + "_arches"] = edge_masks
+    meta = {"format": CSR_FORMAT, "arches": arches, "n_nodes": n, "n_edges": len(edges)}
+
+    dirname = os.path.abspath(dirname)
+    versions = _versions(dirname)
+    current = os.path.realpath(dirname)
+    if os.path.isdir(dirname) and not os.path.islink(dirname):
+        # a graph written as a plain directory, which is moved aside once
+        current = versions[0] = f"{dirname}.0"
+        os.rename(dirname, current)
+    target = f"{dirname}.{max(versions, default=0) + 1}"
+    tmp = f"{target}.{os.getpid()}.tmp"
+    os.makedirs(tmp)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp, name + ".npy"), arr)
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    os.rename(tmp, target)
+    link = f"{dirname}.{os.getpid()}.link"
+    os.symlink(os.path.basename(target), link)
+    os.replace(link, dirname)
+    for path in versions.values():
+        if path != current:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def remove_csr_graph(dirname):
+    """Removes a graph written by ``write_csr_graph()``, with all of its
+    versions.
+    """
+    dirname = os.path.abspath(dirname)
+    if os.path.islink(dirname):
+        os.remove(dirname)
+    elif os.path.isdir(dirname):
+        shutil.rmtree(dirname)
+    for path in _versions(dirname).values():
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class CSRGraph:
+    """A memory mapped channel graph in the binary format, see
+    ``write_csr_graph()``. Packages may be given by name or by index.
+    """
+
+    def __init__(self, dirname, cache_size=4096):
+        """
+        Parameters
+        ----------
+        dirname : str
+            The graph directory.
+        cache_size : int, optional
+            Number of query results to cache.
+        """
+        self.dirname = dirname
+        # the link is only resolved once, so that all of the arrays are read
+        # from the same version
+        path = os.path.realpath(dirname)
+        self.preloaded = False
+        self._results = zict.LRU(cache_size, {})
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["format"] != CSR_FORMAT:
+            raise ValueError(f"unknown graph format {meta['format']!r} in {dirname}")
+        self.arches = meta["arches"]
+        self.n_edges = meta["n_edges"]
+        self._n = meta["n_nodes"]
+        self._bits = {arch: 1 << i for i, arch in enumerate(self.arches)}
+        for name in ARRAYS:
+            setattr(self, "_" + name, np.load(os.path.join(path, name + ".npy"), mmap_mode="r"))
+
+    def __repr__(self):
+        return f"CSRGraph({self.dirname!r})"
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self.name(i)
+
+    def __contains__(self, name):
+        return self._find(name) is not None
+
+    @property
+    def nbytes(self):
+        """The total size of the arrays, most of which are only read in as
+        they are used.
+        """
+        return sum(getattr(self, "_" + name).nbytes for name in ARRAYS)
+
+    def preload(self):
+        """Reads all of the arrays into memory, rather than paging them in
+        from the files as they are used. Returns the graph.
+        """
+        if not self.preloaded:
+            for name in ARRAYS:
+                setattr(self, "_" + name, np.array(getattr(self, "_" + name)))
+            self.preloaded = True
+        return self
+
+    def name(self, i):
+        """The name of the package with an index."""
+        start, stop = self._name_offsets[i], self._name_offsets[i + 1]
+        return self._names[start:stop].tobytes().decode("utf-8")
+
+    def _find(self, name):
+        key = name.encode("utf-8")
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start, stop = self._name_offsets[mid], self._name_offsets[mid + 1]
+            if self._names[start:stop].tobytes() < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n and self.name(lo) == name:
+            return lo
+        return None
+
+    def index(self, name):
+        """The index of a package, raising KeyError if it is not in the graph."""
+        i = self._find(name)
+        if i is None:
+            raise KeyError(name)
+        return i
+
+    def _index(self, node):
+        return self.index(node) if isinstance(node, str) else int(node)
+
+    def arch_mask(self, arches):
+        """The bitmask of some arch names. Arches that are not in the graph
+        have no bits.
+        """
+        if isinstance(arches, str):
+            arches = [arches]
+        return sum(self._bits.get(a, 0) for a in arches)
+
+    def _arch_names(self, mask):
+        mask = int(mask)
+        return {a for a, bit in self._bits.items() if mask & bit}
+
+    def node_arches(self, node):
+        """The arches that a package has artifacts for."""
+        return self._arch_names(self._node_arches[self._index(node)])
+
+    def _neighbors(self, prefix, node, arch):
+        i = self._index(node)
+        indptr = getattr(self, f"_{prefix}_indptr")
+        start, stop = indptr[i], indptr[i + 1]
+        indices = getattr(self, f"_{prefix}_indices")[start:stop]
+        if arch is not None:
+            masks = getattr(self, f"_{prefix}_arches")[start:stop]
+            indices = indices[(masks & np.uint64(self.arch_mask(arch))) != 0]
+        return np.asarray(indices)
+
+    def out_neighbors(self, node, arch=None):
+        """The indices of the packages that require a package, optionally
+        only on some arches.
+        """
+        return self._neighbors("out", node, arch)
+
+    def in_neighbors(self, node, arch=None):
+        """The indices of the packages that a package requires, optionally
+        only on some arches.
+        """
+        return self._neighbors("in", node, arch)
+
+    def dependents(self, node, arch=None):
+        """The names of the packages that require a package."""
+        return [self.name(i) for i in self.out_neighbors(node, arch)]
+
+    def dependencies(self, node, arch=None):
+        """The names of the packages that a package requires."""
+        return [self.name(i) for i in self.in_neighbors(node, arch)]
+
+    def edge_arches(self, dep, pkg):
+        """The arches that ``pkg`` requires ``dep`` on, which is empty if it
+        does not.
+        """
+        i, j = self._index(dep), self._index(pkg)
+        start, stop = self._out_indptr[i], self._out_indptr[i + 1]
+        k = start + int(np.searchsorted(self._out_indices[start:stop], j))
+        if k < stop and self._out_indices[k] == j:
+            return self._arch_names(self._out_arches[k])
+        return set()
+
+    def _cached(self, key, func):
+        if key not in self._results:
+            self._results[key] = func()
+        return self._results[key]
+
+    def _closure(self, i, reverse, max_depth, arch):
+        neighbors = self.in_neighbors if reverse else self.out_neighbors
+        depths = {i: 0}
+        queue = deque([i])
+        while queue:
+            j = queue.popleft()
+            depth = depths[j] + 1
+            if max_depth is not None and depth > max_depth:
+                continue
+            for k in neighbors(j, arch).tolist():
+                if k not in depths:
+                    depths[k] = depth
+                    queue.append(k)
+        del depths[i]
+        return {self.name(j): d for j, d in sorted(depths.items())}
+
+    def _arch_key(self, arch):
+        return None if arch is None else self.arch_mask(arch)
+
+    def dependency_closure(self, node, max_depth=None, arch=None):
+        """The transitive requirements of a package. Results are cached, and
+        must not be modified.
+
+        Parameters
+        ----------
+        node : str or int
+            The package.
+        max_depth : int or None, optional
+            Only follow requirements this many levels deep.
+        arch : str, list of str or None, optional
+            Only follow requirements on these arches.
+
+        Returns
+        -------
+        depths : dict
+            Maps the names of the packages that are required to how many
+            levels down they first are.
+        """
+        i = self._index(node)
+        key = ("dependencies", i, max_depth, self._arch_key(arch))
+        return self._cached(key, lambda: self._closure(i, True, max_depth, arch))
+
+    def dependent_closure(self, node, max_depth=None, arch=None):
+        """The packages that transitively require a package, which are those
+        that would need to be rebuilt if it changed. See
+        ``dependency_closure()`` for the parameters.
+        """
+        i = self._index(node)
+        key = ("dependents", i, max_depth, self._arch_key(arch))
+        return self._cached(key, lambda: self._closure(i, False, max_depth, arch))
+
+    def _rebuild_order(self, i, max_depth, arch):
+        todo = {i} | {self.index(name) for name in self.dependent_closure(i, max_depth, arch)}
+        # the number of requirements in the rebuild that each package waits on
+        waiting = {j: sum(1 for k in self.in_neighbors(j, arch).tolist() if k in todo and k != j)
+                   for j in todo}
+        stages = []
+        stage = sorted(j for j, n in waiting.items() if n == 0)
+        while stage:
+            stages.append([self.name(j) for j in stage])
+            next_stage = []
+            for j in stage:
+                del waiting[j]
+                for k in self.out_neighbors(j, arch).tolist():
+                    if k in waiting and k != j:
+                        waiting[k] -= 1
+                        if waiting[k] == 0:
+                            next_stage.append(k)
+            stage = sorted(next_stage)
+        return {"stages": stages, "cycles": sorted(self.name(j) for j in waiting)}
+
+    def rebuild_order(self, node, max_depth=None, arch=None):
+        """The order to rebuild a package and the packages that depend on it
+        in. See ``dependency_closure()`` for the parameters.
+
+        Returns
+        -------
+        order : dict
+            ``"stages"`` is a list of lists of package names, starting with
+            the package itself, where each package only requires packages in
+            earlier stages. ``"cycles"`` is the packages that could not be
+            ordered because they are in, or depend on, a requirement cycle.
+        """
+        i = self._index(node)
+        key = ("rebuild", i, max_depth, self._arch_key(arch))
+        return self._cached(key, lambda: self._rebuild_order(i, max_depth, arch))
@@ -57,6 +57,24 @@ def libcflib_logfile():
     return flf
 
 
+def libcflib_reap_queue():
+    """Ensures and returns the $LIBCFLIB_REAP_QUEUE"""
+    env = builtins.__xonsh__.env
+    return os.path.join(env.get("LIBCFLIB_DATA_DIR"), "reap_queue.sqlite")
+
+
+def libcflib_manifest():
+    """Ensures and returns the $LIBCFLIB_MANIFEST"""
+    env = builtins.__xonsh__.env
+    return os.path.join(env.get("LIBCFLIB_DATA_DIR"), "manifest.sqlite")
+
+
+def libcflib_repodata_cache():
+    """Ensures and returns the $LIBCFLIB_REPODATA_CACHE"""
+    env = builtins.__xonsh__.env
+    return os.path.join(env.get("LIBCFLIB_DATA_DIR"), "repodata_cache")
+
+
 def libcfgraph_dir():
     """Ensures and returns the $LIBCFGRAPH_DIR"""
     env = builtins.__xonsh__.env
@@ -64,6 +82,12 @@ def libcfgraph_dir():
     return s
 
 
+def libcfgraph_snapshots():
+    """Ensures and returns the $LIBCFGRAPH_SNAPSHOTS"""
+    env = builtins.__xonsh__.env
+    return os.path.join(env.get("LIBCFLIB_DATA_DIR"), "libcfgraph-snapshots")
+
+
 def libcfgraph_index():
     """Ensures and returns the $LIBCFGRAPH_INDEX"""
     env = builtins.__xonsh__.env
@@ -106,6 +130,36 @@ ENVVARS = OrderedDict(
                 "Path to the libcflib logfile.",
             ),
         ),
+        (
+            "LIBCFLIB_REAP_QUEUE",
+            (
+                libcflib_reap_queue,
+                is_string,
+                expand_file_and_mkdirs,
+                ensure_string,
+                "Path to the work queue of artifacts waiting to be reaped.",
+            ),
+        ),
+        (
+            "LIBCFLIB_MANIFEST",
+            (
+                libcflib_manifest,
+                is_string,
+                expand_file_and_mkdirs,
+                ensure_string,
+                "Path to the manifest of the artifacts that have been reaped.",
+            ),
+        ),
+        (
+            "LIBCFLIB_REPODATA_CACHE",
+            (
+                libcflib_repodata_cache,
+                is_string,
+                str,
+                ensure_string,
+                "Path to the directory where upstream repodata is cached.",
+            ),
+        ),
         (
             "LIBCFGRAPH_DIR",
             (
@@ -116,6 +170,17 @@ ENVVARS = OrderedDict(
                 "Path to the libcfgraph repository directory.",
             ),
         ),
+        (
+            "LIBCFGRAPH_SNAPSHOTS",
+            (
+                libcfgraph_snapshots,
+                is_string,
+                str,
+                ensure_string,
+                "Path to the directory of libcfgraph worktrees that the REST "
+                "server swaps between as the graph is updated.",
+            ),
+        ),
         (
             "LIBCFGRAPH_INDEX",
             (
@@ -138,7 +203,13 @@ ENVVARS = OrderedDict(
         ),
         (
             "LIBCFLIB_DB_CACHE_SIZE",
-            (1000000, is_int, int, str, "Size of the database LRU cache"),
+            (
+                2**28,
+                is_int,
+                int,
+                str,
+                "Size of the database LRU cache, in bytes of loaded data",
+            ),
         ),
     ]
 )
@@ -2,17 +2,42 @@
 Harvests metadata out of a built conda package
 """
 
+import bz2
 import io
 import json
 import os
-import sys
 import tarfile
+from concurrent.futures import as_completed, ProcessPoolExecutor
 
 from ruamel_yaml.scanner import ScannerError
 import ruamel_yaml
+import tqdm
+
+from libcflib.store import artifact_path, artifact_stamp, dump_artifact
+from libcflib.tools import expand_file_and_mkdirs
 
 METADATA_VERSION = 1
 
+PACKAGE_EXTENSIONS = (".tar.bz2", ".conda")
+
+KNOWN_SUBDIRS = frozenset(
+    [
+        "noarch",
+        "linux-32",
+        "linux-64",
+        "linux-aarch64",
+        "linux-armv6l",
+        "linux-armv7l",
+        "linux-ppc64le",
+        "linux-s390x",
+        "osx-64",
+        "osx-arm64",
+        "win-32",
+        "win-64",
+        "win-arm64",
+    ]
+)
+
 
 def filter_file(filename):
     if not filename:
@@ -56,20 +81,73 @@ def harvest_dot_conda(io_like, filename):
     return data
 
 
-def harvest(io_like):
-    tf = tarfile.open(fileobj=io_like, mode="r:bz2")
-    data = harvest_tarfile(tf)
+class CountingReader:
+    """A read-only file wrapper that counts the bytes read through it."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.nbytes = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.nbytes += len(data)
+        return data
+
+
+def harvest(io_like, streaming=False, stats=None):
+    """Harvests the metadata from a .tar.bz2 conda package.
+
+    Parameters
+    ----------
+    io_like : file-like
+        The (compressed) package. This need not be seekable when streaming.
+    streaming : bool, optional
+        Reads the tarball sequentially and stops decompressing as soon as the
+        ``info/`` directory has been read, rather than walking every member.
+    stats : dict or None, optional
+        If given, the number of decompressed bytes that were read is stored
+        under the ``"decompressed_bytes"`` key.
+
+    Returns
+    -------
+    dict
+        The harvested data.
+    """
+    if streaming:
+        decompressed = CountingReader(bz2.BZ2File(io_like))
+        tf = tarfile.open(fileobj=decompressed, mode="r|")
+        data = harvest_tarfile(tf, early_exit=True)
+        nbytes = decompressed.nbytes
+    else:
+        tf = tarfile.open(fileobj=io_like, mode="r:bz2")
+        data = harvest_tarfile(tf)
+        nbytes = tf.fileobj.tell()
+    if stats is not None:
+        stats["decompressed_bytes"] = nbytes
     data["conda_pkg_format"] = None
     return data
 
 
-def harvest_tarfile(tf_or_stream):
+def harvest_tarfile(tf_or_stream, early_exit=False):
+    """Harvests the metadata out of the members of a package tarball.
+
+    Parameters
+    ----------
+    tf_or_stream : TarFile or iterable of (TarFile, TarInfo)
+        The members to harvest.
+    early_exit : bool, optional
+        Stop iterating at the first non-``info/`` member after
+        ``info/index.json`` has been seen. conda-build writes the ``info/``
+        directory contiguously (and first), so nothing is lost, but the
+        remainder of the payload never needs to be decompressed.
+    """
     rendered_recipe = {}
     index = {}
     about = {}
     raw_recipe = ""
     conda_build_config = {}
     raw_recipe_backup = ""
+    seen_index = False
 
     for _data in tf_or_stream:
         if isinstance(_data, tarfile.TarInfo):
@@ -78,6 +156,9 @@ def harvest_tarfile(tf_or_stream):
         else:
             tf, mem = _data
 
+        if early_exit and seen_index and not mem.name.startswith("info/"):
+            break
+
         if mem.name == "info/files":
             # info/files
             file_listing = tf.extractfile(mem).readlines()
@@ -102,6 +183,7 @@ def harvest_tarfile(tf_or_stream):
             about = json.loads(tf.extractfile(mem).read(mem.size))
         elif mem.name == "info/index.json":
             index = json.loads(tf.extractfile(mem).read(mem.size))
+            seen_index = True
         elif mem.name == "info/recipe/meta.yaml.template":
             raw_recipe = tf.extractfile(mem).read(mem.size).decode("utf8")
         elif mem.name == "info/recipe/conda_build_config.yaml":
@@ -123,15 +205,152 @@ def harvest_tarfile(tf_or_stream):
 def harvest_from_filename(filename):
     with open(filename, "rb") as fo:
         if filename.endswith(".tar.bz2"):
-            return harvest(fo)
+            return harvest(fo, streaming=True)
         elif filename.endswith(".conda"):
             return harvest_dot_conda(fo, filename)
         else:
             raise RuntimeError(f"File '{filename}' is not a recognized conda format!")
 
 
+def _split_package_filename(filename):
+    """Returns the package name and the artifact name (without extension)
+    of a conda package filename.
+    """
+    basename = os.path.basename(filename)
+    for ext in PACKAGE_EXTENSIONS:
+        if basename.endswith(ext):
+            name = basename[: -len(ext)]
+            break
+    else:
+        raise RuntimeError(f"File '{filename}' is not a recognized conda format!")
+    return name.rsplit("-", 2)[0], name
+
+
+def _guess_subdir(filename):
+    """Gets the subdir from the parent directory of a package, as laid out in a
+    channel mirror. Returns None for flat layouts, such as a pkgs/ cache.
+    """
+    parent = os.path.basename(os.path.dirname(os.path.abspath(filename)))
+    return parent if parent in KNOWN_SUBDIRS else None
+
+
+def find_packages(root):
+    """Yields the paths of all conda packages in a directory tree."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for fname in sorted(filenames):
+            if fname.endswith(PACKAGE_EXTENSIONS):
+                yield os.path.join(dirpath, fname)
+
+
+def is_harvested(filename, output_dir, channel, subdir=None):
+    """Whether a package file already has an artifact in an artifacts
+    directory, in any of its forms, worked out from the filename alone so that
+    the package need not be opened. When the subdir is not known, as in flat
+    layouts, the artifact is looked for in all of the known subdirs.
+    """
+    pkg, name = _split_package_filename(filename)
+    subdirs = [subdir] if subdir is not None else sorted(KNOWN_SUBDIRS)
+    return any(
+        artifact_stamp(output_dir, artifact_path(pkg, channel, s, name)) is not None
+        for s in subdirs
+    )
+
+
+def harvest_to_artifact(filename, output_dir, channel, subdir=None):
+    """Harvests a package file into the artifacts layout, i.e.
+    ``<output_dir>/<pkg>/<channel>/<subdir>/<name>.json``. Existing artifacts
+    are not overwritten, and packages that already have one are not opened.
+
+    Returns
+    -------
+    str or None
+        The path to the newly written artifact, or None if it already existed.
+    """
+    if is_harvested(filename, output_dir, channel, subdir):
+        return None
+    pkg, name = _split_package_filename(filename)
+    data = harvest_from_filename(filename)
+    if subdir is None:
+        subdir = data["index"].get("subdir", "noarch")
+    dst = os.path.join(output_dir, artifact_path(pkg, channel, subdir, name))
+    if os.path.exists(dst):
+        return None
+    dump_artifact(data, expand_file_and_mkdirs(dst))
+    return dst
+
+
+def harvest_directory(root, output_dir, channel="conda-forge", max_workers=None):
+    """Harvests every conda package in a directory tree, such as a local channel
+    mirror or a pkgs/ cache, using a process pool. The results are written into
+    the artifacts layout under ``output_dir`` and existing artifacts are skipped.
+
+    Parameters
+    ----------
+    root : str
+        Directory to search for ``.tar.bz2`` and ``.conda`` files.
+    output_dir : str
+        The artifacts directory to write into.
+    channel : str, optional
+        Channel name to file the artifacts under.
+    max_workers : int or None, optional
+        Number of worker processes, defaults to the number of CPUs.
+
+    Returns
+    -------
+    dict
+        Counts of the ``"harvested"``, ``"skipped"`` and ``"failed"`` packages.
+    """
+    counts = {"harvested": 0, "skipped": 0, "failed": 0}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for filename in find_packages(root):
+            subdir = _guess_subdir(filename)
+            if is_harvested(filename, output_dir, channel, subdir):
+                counts["skipped"] += 1
+                continue
+            fut = pool.submit(harvest_to_artifact, filename, output_dir, channel, subdir)
+            futures[fut] = filename
+        for fut in tqdm.tqdm(as_completed(futures), total=len(futures)):
+            try:
+                dst = fut.result()
+            except Exception as e:
+                print(f"FAILURE {futures[fut]!r} {e}")
+                counts["failed"] += 1
+                continue
+            counts["harvested" if dst is not None else "skipped"] += 1
+    return counts
+
+
 if __name__ == "__main__":
-    o = harvest_from_filename(sys.argv[1])
-    output = io.StringIO()
-    ruamel_yaml.dump(o, output)
-    print(output.getvalue())
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="a conda package, or a directory of them")
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        help="artifacts directory to write into when harvesting a directory",
+    )
+    parser.add_argument("--channel", default="conda-forge")
+    parser.add_argument(
+        "-j", "--max-workers", type=int, default=None, help="number of processes"
+    )
+
+    args = parser.parse_args()
+    if os.path.isdir(args.path):
+        if args.output_dir is None:
+            parser.error("--output-dir is required when harvesting a directory")
+        print(
+            harvest_directory(
+                args.path,
+                args.output_dir,
+                channel=args.channel,
+                max_workers=args.max_workers,
+            )
+        )
+    else:
+        o = harvest_from_filename(args.path)
+        output = io.StringIO()
+        ruamel_yaml.dump(o, output)
+        print(output.getvalue())
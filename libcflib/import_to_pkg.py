@@ -1,7 +1,5 @@
 import sys
-import glob
 import hashlib
-import json
 import os
 from collections import defaultdict
 from json import JSONDecodeError
@@ -12,6 +10,8 @@ from tqdm import tqdm
 
 from libcflib.logger import LOGGER
 from libcflib.jsonutils import dump, load
+from libcflib.store import load_artifact_file
+from libcflib.walker import walk_artifact_paths
 from concurrent.futures import as_completed, ThreadPoolExecutor
 from itertools import groupby, chain
 
@@ -74,8 +74,7 @@ def extract_importable_files(file_list):
 
 
 def get_imports_and_files(file):
-    with open(file) as f:
-        data = json.load(f)
+    data = load_artifact_file(file)
 
     pkg_files: List[str] = extract_importable_files(data.get("files", []))
     # TODO: handle top level things that are stand alone .py files
@@ -144,7 +143,9 @@ if __name__ == "__main__":
         n_max = 10_000
 
     futures = {}
-    all_files = set(glob.glob("artifacts/**/*.json", recursive=True))
+    all_files = {
+        os.path.join("artifacts", path) for path in walk_artifact_paths("artifacts")
+    }
     new_files = all_files - indexed_files
 
     with ThreadPoolExecutor(max_workers=4) as tpe:
@@ -3,33 +3,43 @@ Index the artifacts.
 """
 
 import os
-import glob
+import json
+import base64
+import sqlite3
+import builtins
+from concurrent.futures import ProcessPoolExecutor
 
+from libcflib.schemas import SCHEMAS
+from libcflib.store import (
+    artifact_stamp,
+    iter_artifact_paths,
+    iter_artifact_stamps,
+    load_artifact,
+)
 
-try:
-    from pandas._lib.json import load as load_json_file
-except ImportError:
-    import json
-
-    load_json_file = json.load
+# fields of every artifact that come from its path, rather than its data
+SPEC_FIELDS = ("path", "pkg", "channel", "arch", "filename")
+INDEX_FILENAME = "index.sqlite"
+# fields of every artifact that are kept in the summary table, for picking
+# the latest artifact of a package without loading them all
+SUMMARY_FIELDS = ("version", "build_number", "build")
 
 
 def _all_artifacts(root):
-    files = glob.glob(f"{root}/*/*/*/*.json")
-    for f in files:
-        yield f.replace(f"{root}/", "")
+    yield from iter_artifact_paths(root)
 
 
-def _indexed_artifacts(root, ix):
-    with ix.searcher() as searcher:
-        for fields in searcher.all_stored_fields():
-            yield fields["path"]
+def _indexed_artifacts(ix):
+    return dict(ix.conn.execute("SELECT path, stamp FROM docs"))
 
 
 def _unindexed_artifacts(root, ix):
-    artifacts = set(_all_artifacts(root))
-    indexed = set(_indexed_artifacts(root, ix))
-    return artifacts - indexed
+    indexed = _indexed_artifacts(ix)
+    return {
+        path
+        for path, stamp in iter_artifact_stamps(root)
+        if indexed.get(path) != stamp
+    }
 
 
 def get_artifact(root_path, artifact, progress_callback=None):
@@ -50,8 +60,7 @@ def get_artifact(root_path, artifact, progress_callback=None):
 
     if progress_callback:
         progress_callback()
-    with open(os.path.join(root_path, artifact), "r") as f:
-        data = load_json_file(f)
+    data = load_artifact(root_path, artifact)
     package, channel, arch, name = artifact.split(os.sep)
     name = os.path.splitext(name)[0]
     data.update(
@@ -66,15 +75,449 @@ def get_artifact(root_path, artifact, progress_callback=None):
     return data
 
 
-def index(path):
-    """Index all of the artifacts in a specified directory.
+def indexed_fields(schema=None):
+    """The top-level artifact fields that are full-text indexed, in order."""
+    schema = SCHEMAS["artifact"]["schema"] if schema is None else schema
+    return list(schema)
+
+
+def stored_fields(schema=None):
+    """The top-level artifact fields that are stored in the index, and so can
+    be returned from it without loading the artifact. These are the ones that
+    are marked with ``"stored": True`` in the schema.
+    """
+    schema = SCHEMAS["artifact"]["schema"] if schema is None else schema
+    return [k for k, v in schema.items() if v.get("stored", False)]
+
+
+def _text(value):
+    """Flattens a field value into the text that is indexed for it."""
+    if value is None:
+        return ""
+    elif isinstance(value, str):
+        return value
+    elif isinstance(value, dict):
+        return " ".join(_text(v) for v in value.values())
+    elif isinstance(value, (list, tuple)):
+        return " ".join(_text(v) for v in value)
+    return str(value)
+
+
+def _summary(data):
+    """The summary row values of an artifact's data, see ``SUMMARY_FIELDS``."""
+    index = data.get("index") or {}
+    return [data.get("version"), index.get("build_number"), index.get("build")]
+
+
+def _parse(args):
+    """Turns an artifact into the rows that are indexed for it, returning
+    ``(path, texts, stored, summary)``, or ``(path, None, error, None)`` if it
+    could not be read. This runs in worker processes.
+    """
+    root, path, fields, stored = args
+    try:
+        data = get_artifact(root, path)
+    except Exception as e:
+        return path, None, repr(e), None
+    texts = [data[f] for f in SPEC_FIELDS[1:]] + [_text(data.get(f)) for f in fields]
+    stored = json.dumps({f: data[f] for f in stored if f in data})
+    return path, texts, stored, _summary(data)
+
+
+def fts_query(query):
+    """Turns a free text query into an FTS5 query that matches documents
+    containing all of its whitespace separated terms. Each term is quoted, so
+    that punctuation, such as in ``numpy-1.16``, is not taken as syntax.
+    """
+    terms = query.split()
+    return " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def encode_cursor(score, rowid):
+    """Encodes the position of a search result as an opaque cursor string."""
+    return base64.urlsafe_b64encode(json.dumps([score, rowid]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor from ``encode_cursor()``, raising ValueError if it is
+    not valid.
+    """
+    try:
+        score, rowid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(score), int(rowid)
+    except Exception:
+        raise ValueError(f"invalid search cursor {cursor!r}")
+
+
+class ArtifactIndex:
+    """An SQLite FTS5 full-text index of an artifacts directory.
+
+    Every artifact is a row of the ``docs`` table, which holds its path, a
+    stamp of the file it was indexed from (see
+    ``store.iter_artifact_stamps()``) and, as JSON, the fields that are
+    stored in the index. The ``fts`` table has a column for each of the
+    spec fields and each of the top-level fields in the artifact schema, and
+    shares its rowids with ``docs``. So does the ``summary`` table, which
+    has the package, channel and arch of every artifact along with its
+    ``SUMMARY_FIELDS``.
+    """
+
+    def __init__(self, filename=None, fields=None, stored=None, readonly=False):
+        """
+        Parameters
+        ----------
+        filename : str or None, optional
+            Path to the index file, which is created if needed. Defaults to
+            index.sqlite in $LIBCFGRAPH_INDEX.
+        fields : list of str or None, optional
+            The fields to index, defaults to ``indexed_fields()``.
+        stored : list of str or None, optional
+            The fields to store, defaults to ``stored_fields()``.
+        readonly : bool, optional
+            Open an existing index only for searching.
+        """
+        if filename is None:
+            filename = default_index_file()
+        self.filename = filename
+        self.fields = indexed_fields() if fields is None else list(fields)
+        self.stored = stored_fields() if stored is None else list(stored)
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{filename}?mode=ro", uri=True)
+            return
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        layout = json.dumps({"fields": self.fields, "stored": self.stored,
+                             "summary": list(SUMMARY_FIELDS)})
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key = 'layout'"
+            ).fetchone()
+            if row is None or row[0] != layout:
+                # the schema has changed, so everything must be indexed again,
+                # and anything recorded about the old contents is stale
+                self.conn.execute("DELETE FROM meta")
+                self.conn.execute("DROP TABLE IF EXISTS docs")
+                self.conn.execute("DROP TABLE IF EXISTS fts")
+                self.conn.execute("DROP TABLE IF EXISTS summary")
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('layout', ?)", (layout,)
+                )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS docs (id INTEGER PRIMARY KEY, "
+                "path TEXT UNIQUE NOT NULL, stamp TEXT NOT NULL, stored TEXT NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS summary (id INTEGER PRIMARY KEY, "
+                "pkg TEXT NOT NULL, channel TEXT NOT NULL, arch TEXT NOT NULL, "
+                "path TEXT NOT NULL, version TEXT, build_number INTEGER, build TEXT)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS summary_pkg ON summary (pkg, channel, arch)"
+            )
+            columns = ", ".join(f'"{c}"' for c in SPEC_FIELDS[1:] + tuple(self.fields))
+            self.conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5({columns})")
+        placeholders = ", ".join("?" * (len(SPEC_FIELDS) + len(self.fields)))
+        self._insert_fts = f"INSERT INTO fts (rowid, {columns}) VALUES ({placeholders})"
+
+    def __repr__(self):
+        return f"ArtifactIndex({self.filename!r})"
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def __contains__(self, path):
+        row = self.conn.execute("SELECT 1 FROM docs WHERE path = ?", (path,)).fetchone()
+        return row is not None
+
+    def close(self):
+        self.conn.close()
+
+    def get_meta(self, key):
+        """Returns a value recorded in the index with ``set_meta()``, or None."""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_meta(self, key, value):
+        """Records a string value in the index, such as the commit that it is
+        up to date with. Values are cleared when the index is rebuilt.
+        """
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def backup(self, filename):
+        """Copies the index to another file, consistently, even if it is
+        being written to.
+        """
+        dst = sqlite3.connect(filename)
+        try:
+            self.conn.backup(dst)
+        finally:
+            dst.close()
+
+    def restamp(self, root, exclude=()):
+        """Replaces the stamps of the indexed artifacts with those of the
+        same artifacts in another directory, without reading them, such as
+        when the index is copied for another checkout of the graph. Only
+        artifacts that are the same in both directories may be restamped, so
+        those that differ must be excluded and updated instead.
+
+        Parameters
+        ----------
+        root : str
+            The artifacts directory to take the stamps from.
+        exclude : iterable of str, optional
+            Artifacts to keep the stamps of.
+
+        Returns
+        -------
+        n : int
+            The number of artifacts restamped.
+        """
+        exclude = set(exclude)
+        indexed = _indexed_artifacts(self)
+        rows = [(stamp, path) for path, stamp in iter_artifact_stamps(root)
+                if path in indexed and path not in exclude and indexed[path] != stamp]
+        with self.conn:
+            self.conn.executemany("UPDATE docs SET stamp = ? WHERE path = ?", rows)
+        return len(rows)
+
+    def stored_data(self, path):
+        """Returns the stored fields of an indexed artifact, or None if it is
+        not in the index.
+        """
+        row = self.conn.execute(
+            "SELECT stored FROM docs WHERE path = ?", (path,)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def summaries(self, pkg, channel=None, arches=None):
+        """Returns the summary rows of the indexed artifacts of a package.
+
+        Parameters
+        ----------
+        pkg : str
+            The package name.
+        channel : str or None, optional
+            Only return artifacts in this channel.
+        arches : list of str or None, optional
+            Only return artifacts for these arches.
+
+        Returns
+        -------
+        summaries : dict
+            Maps artifact paths to their ``(version, build_number, build)``.
+        """
+        sql = "SELECT path, version, build_number, build FROM summary WHERE pkg = ?"
+        params = [pkg]
+        if channel is not None:
+            sql += " AND channel = ?"
+            params.append(channel)
+        if arches is not None:
+            arches = list(arches)
+            sql += " AND arch IN ({})".format(", ".join("?" * len(arches)))
+            params += arches
+        return {row[0]: row[1:] for row in self.conn.execute(sql, params)}
+
+    def summary_frame(self, pkgs=None):
+        """Returns the whole summary table, or the rows of some packages, as a
+        DataFrame with ``pkg``, ``channel``, ``arch``, ``path`` and the
+        ``SUMMARY_FIELDS`` columns.
+        """
+        import pandas as pd
+
+        sql = "SELECT pkg, channel, arch, path, version, build_number, build FROM summary"
+        if pkgs is None:
+            return pd.read_sql_query(sql, self.conn)
+        pkgs = sorted(pkgs)
+        frames = [pd.read_sql_query(sql + " WHERE pkg IN ({})".format(", ".join("?" * len(chunk))),
+                                    self.conn, params=chunk)
+                  for chunk in (pkgs[i:i + 500] for i in range(0, len(pkgs), 500))]
+        if not frames:
+            return pd.read_sql_query(sql + " LIMIT 0", self.conn)
+        return pd.concat(frames, ignore_index=True)
+
+    def search(self, query, limit=10, cursor=None, offset=0):
+        """Searches the index, ranking the results by BM25 relevance.
+
+        Parameters
+        ----------
+        query : str
+            Free text query, see ``fts_query()``.
+        limit : int, optional
+            Maximum number of results.
+        cursor : str or None, optional
+            The ``next_cursor`` of the previous page of results. Paging with
+            cursors costs the same for every page, and does not skip or
+            repeat results when other pages would be shifted by offsets.
+        offset : int, optional
+            Number of results to skip, when there is no cursor.
+
+        Returns
+        -------
+        paths : list of str
+            The artifact paths of the results.
+        next_cursor : str or None
+            Cursor for the next page, or None if this is the last one.
+        """
+        match = fts_query(query)
+        if not match:
+            return [], None
+        sql = (
+            "SELECT docs.path, m.score, m.id FROM "
+            "(SELECT rowid AS id, bm25(fts) AS score FROM fts WHERE fts MATCH ?) AS m "
+            "JOIN docs ON docs.id = m.id "
+        )
+        params = [match]
+        if cursor is not None:
+            score, rowid = decode_cursor(cursor)
+            sql += "WHERE m.score > ? OR (m.score = ? AND m.id > ?) "
+            params += [score, score, rowid]
+            offset = 0
+        sql += "ORDER BY m.score, m.id LIMIT ? OFFSET ?"
+        # one more than asked for, to know whether there is a next page
+        params += [limit + 1, offset]
+        rows = self.conn.execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][2])
+        return [row[0] for row in rows], next_cursor
+
+    def _remove(self, paths):
+        for path in paths:
+            row = self.conn.execute("SELECT id FROM docs WHERE path = ?", (path,)).fetchone()
+            if row is not None:
+                self.conn.execute("DELETE FROM fts WHERE rowid = ?", row)
+                self.conn.execute("DELETE FROM summary WHERE id = ?", row)
+                self.conn.execute("DELETE FROM docs WHERE id = ?", row)
+
+    def _add(self, path, stamp, texts, stored, summary):
+        self._remove([path])
+        cur = self.conn.execute(
+            "INSERT INTO docs (path, stamp, stored) VALUES (?, ?, ?)",
+            (path, stamp, stored),
+        )
+        self.conn.execute(self._insert_fts, [cur.lastrowid] + texts)
+        # texts starts with the pkg, channel and arch
+        self.conn.execute(
+            "INSERT INTO summary VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [cur.lastrowid] + texts[:3] + [path] + summary,
+        )
+
+    def update(self, root, batch_size=5000, max_workers=None, paths=None):
+        """Brings the index up to date with an artifacts directory, indexing
+        the artifacts that are new or have changed since they were indexed,
+        and removing those that are gone.
+
+        Parameters
+        ----------
+        root : str
+            The artifacts directory.
+        batch_size : int, optional
+            Number of artifacts to index in each transaction.
+        max_workers : int or None, optional
+            Number of processes to parse artifacts with. 1 parses them in
+            this process.
+        paths : iterable of str or None, optional
+            Only update these artifacts, rather than the whole directory.
+
+        Returns
+        -------
+        counts : dict
+            The number of artifacts that were ``"indexed"``, ``"removed"``
+            and that ``"failed"`` to be read.
+        """
+        counts = {"indexed": 0, "removed": 0, "failed": 0}
+        indexed = _indexed_artifacts(self)
+        if paths is None:
+            stamps = dict(iter_artifact_stamps(root))
+            removed = indexed.keys() - stamps.keys()
+        else:
+            stamps = {p: artifact_stamp(root, p) for p in set(paths)}
+            removed = {p for p, s in stamps.items() if s is None and p in indexed}
+            stamps = {p: s for p, s in stamps.items() if s is not None}
+        todo = sorted(p for p, s in stamps.items() if indexed.get(p) != s)
+        with self.conn:
+            self._remove(removed)
+        counts["removed"] = len(removed)
+        args = ((root, p, self.fields, self.stored) for p in todo)
+        if max_workers == 1:
+            pool = None
+            results = map(_parse, args)
+        else:
+            pool = ProcessPoolExecutor(max_workers=max_workers)
+            results = pool.map(_parse, args, chunksize=64)
+        try:
+            for i, (path, texts, stored, summary) in enumerate(results, 1):
+                if texts is None:
+                    print(f"FAILED TO INDEX {path}: {stored}")
+                    counts["failed"] += 1
+                else:
+                    self._add(path, stamps[path], texts, stored, summary)
+                    counts["indexed"] += 1
+                if i % batch_size == 0:
+                    self.conn.commit()
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return counts
+
+    def optimize(self):
+        """Merges the segments of the full-text index, for faster queries."""
+        with self.conn:
+            self.conn.execute("INSERT INTO fts(fts) VALUES ('optimize')")
+
+
+def default_index_file():
+    """The default index file, index.sqlite in $LIBCFGRAPH_INDEX."""
+    index_dir = builtins.__xonsh__.env.get("LIBCFGRAPH_INDEX")
+    os.makedirs(index_dir, exist_ok=True)
+    return os.path.join(index_dir, INDEX_FILENAME)
+
+
+def index(path, filename=None, batch_size=5000, max_workers=None, optimize=None):
+    """Index all of the artifacts in a specified directory. Only artifacts
+    that are new or have changed since the last run are parsed again.
 
     Parameters
     ----------
     path : str
         The path to the directory containing the artifacts to be indexed.
+    filename : str or None, optional
+        The index file, defaults to index.sqlite in $LIBCFGRAPH_INDEX.
+    batch_size : int, optional
+        Number of artifacts to index in each transaction.
+    max_workers : int or None, optional
+        Number of processes to parse artifacts with.
+    optimize : bool or None, optional
+        Whether to merge the segments of the full-text index afterwards. This
+        rewrites the whole index, so by default it is only done when the
+        index was built from empty, and incremental runs are left to the
+        automatic merging of FTS5.
+
+    Returns
+    -------
+    counts : dict
+        See ``ArtifactIndex.update()``.
     """
-    raise NotImplementedError("indexer needs to be rewritten to not use whoosh")
+    ix = ArtifactIndex(filename)
+    try:
+        if optimize is None:
+            optimize = len(ix) == 0
+        counts = ix.update(path, batch_size=batch_size, max_workers=max_workers)
+        if optimize and (counts["indexed"] or counts["removed"]):
+            ix.optimize()
+    finally:
+        ix.close()
+    return counts
 
 
 if __name__ == "__main__":
@@ -82,6 +525,13 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("root_path")
+    parser.add_argument("--index", help="index file, defaults to index.sqlite in $LIBCFGRAPH_INDEX")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("-j", "--max-workers", type=int, default=None,
+                        help="number of processes to parse artifacts with")
+    parser.add_argument("--optimize", action="store_true", default=None,
+                        help="merge the full-text index afterwards, even if it was not built from empty")
     args = parser.parse_args()
     print(args)
-    index(args.root_path)
+    print(index(args.root_path, filename=args.index, batch_size=args.batch_size,
+                max_workers=args.max_workers, optimize=args.optimize))
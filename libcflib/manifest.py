@@ -0,0 +1,130 @@
+"""A persistent manifest of the artifacts that have been harvested."""
+import os
+import sqlite3
+from itertools import islice
+
+from libcflib.store import iter_artifact_paths
+
+# number of paths that are looked up in the manifest at a time
+BATCH_SIZE = 500
+
+
+class Manifest:
+    """A SQLite set of the artifact paths, relative to an artifacts directory,
+    that are present on disk. It replaces walking the whole directory tree to
+    find out what has already been harvested.
+    """
+
+    def __init__(self, filename, root=None):
+        """
+        Parameters
+        ----------
+        filename : str
+            Path to the manifest file, which is created if needed.
+        root : str or None, optional
+            The artifacts directory that the manifest describes. If given and
+            the manifest was built for a different directory (or never built),
+            it is rebuilt by walking the directory.
+        """
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts (path TEXT PRIMARY KEY) "
+                "WITHOUT ROWID"
+            )
+        if root is not None and self.root != os.path.abspath(root):
+            self.rebuild(root)
+
+    def __repr__(self):
+        return f"Manifest({self.filename!r})"
+
+    def close(self):
+        self.conn.close()
+
+    @property
+    def root(self):
+        """The artifacts directory this manifest was built from, if any."""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'root'").fetchone()
+        return None if row is None else row[0]
+
+    def rebuild(self, root):
+        """Replaces the contents of the manifest with a walk of an artifacts
+        directory.
+        """
+        paths = iter_artifact_paths(root)
+        with self.conn:
+            self.conn.execute("DELETE FROM artifacts")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO artifacts VALUES (?)", ((p,) for p in paths)
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('root', ?)",
+                (os.path.abspath(root),),
+            )
+
+    def add(self, *paths):
+        """Adds artifact paths to the manifest."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO artifacts VALUES (?)", ((p,) for p in paths)
+            )
+
+    def discard(self, *paths):
+        """Removes artifact paths from the manifest, if present."""
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM artifacts WHERE path = ?", ((p,) for p in paths)
+            )
+
+    def __contains__(self, path):
+        cur = self.conn.execute("SELECT 1 FROM artifacts WHERE path = ?", (path,))
+        return cur.fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0]
+
+    def __iter__(self):
+        for (path,) in self.conn.execute("SELECT path FROM artifacts ORDER BY path"):
+            yield path
+
+    def missing(self, records, key=None):
+        """Streams the records that are not in the manifest. The records are
+        joined against the manifest's primary key index in batches, so that
+        neither side needs to be held in memory.
+
+        Parameters
+        ----------
+        records : iterable
+            The records to look up.
+        key : callable or None, optional
+            Maps a record to its artifact path. By default records are
+            ``(package, dst, ...)`` tuples, such as ``RepodataRecord`` instances.
+        """
+        if key is None:
+            key = _record_path
+        records = iter(records)
+        while True:
+            batch = [(key(r), r) for r in islice(records, BATCH_SIZE)]
+            if not batch:
+                return
+            paths = [p for p, _ in batch]
+            qmarks = ",".join("?" * len(paths))
+            found = {
+                row[0]
+                for row in self.conn.execute(
+                    f"SELECT path FROM artifacts WHERE path IN ({qmarks})", paths
+                )
+            }
+            for path, record in batch:
+                if path not in found:
+                    yield record
+
+
+def _record_path(record):
+    return os.path.join(record[0], record[1])
@@ -0,0 +1,68 @@
+"""An in-memory index of which artifacts each package has."""
+import os
+from collections import defaultdict
+
+from libcflib.store import iter_artifact_paths
+
+
+class PackageIndex:
+    """Maps each package name to its channels, each channel to its arches,
+    and each arch to the set of artifact filenames (``<name>.json``) that it
+    has. It is built with one walk of an artifacts directory, and then kept
+    up to date as artifacts are added and removed.
+    """
+
+    def __init__(self):
+        self._d = defaultdict(lambda: defaultdict(lambda: defaultdict(set)))
+
+    def __repr__(self):
+        return f"PackageIndex({len(self)} packages)"
+
+    @classmethod
+    def from_dir(cls, root):
+        """Builds the index of an artifacts directory."""
+        index = cls()
+        for path in iter_artifact_paths(root):
+            index.add(path)
+        return index
+
+    def __contains__(self, pkg):
+        return pkg in self._d
+
+    def __len__(self):
+        return len(self._d)
+
+    def __iter__(self):
+        return iter(self._d)
+
+    def add(self, path):
+        """Adds an artifact by its path, relative to the artifacts directory."""
+        pkg, channel, arch, filename = path.split(os.sep)
+        self._d[pkg][channel][arch].add(filename)
+
+    def discard(self, path):
+        """Removes an artifact by its path, along with any package, channel or
+        arch that it leaves empty.
+        """
+        pkg, channel, arch, filename = path.split(os.sep)
+        if pkg not in self._d or channel not in self._d[pkg] or arch not in self._d[pkg][channel]:
+            return
+        channels = self._d[pkg]
+        channels[channel][arch].discard(filename)
+        if not channels[channel][arch]:
+            del channels[channel][arch]
+            if not channels[channel]:
+                del channels[channel]
+                if not channels:
+                    del self._d[pkg]
+
+    def get(self, pkg):
+        """Returns a copy of the ``{channel: {arch: filenames}}`` dict of a
+        package, which is empty if the package is not known.
+        """
+        if pkg not in self._d:
+            return {}
+        return {
+            channel: {arch: set(names) for arch, names in arches.items()}
+            for channel, arches in self._d[pkg].items()
+        }
@@ -0,0 +1,302 @@
+"""An optional packed storage backend for the artifacts directory.
+
+Rather than one small JSON file per artifact, artifacts are appended to a
+fixed number of pack files, sharded by package name. Each record in a pack is
+the artifact path (its key, e.g. ``numpy/conda-forge/linux-64/numpy-1.0-0``
+plus ``.json``), a newline, and then the JSON document. A sorted index of
+``(hash, pack, offset, length)`` rows is kept as a ``.npy`` file and memory
+mapped for reading, so that a lookup is a binary search and a slice of a
+memory mapped pack, with the key in the record checked against the one asked
+for.
+
+The store lives in the ``.packs`` directory of the artifacts directory, which
+the walker skips.
+"""
+import os
+import json
+import mmap
+import zlib
+import hashlib
+
+import numpy as np
+
+from libcflib.walker import walk_artifact_paths
+
+PACKS_DIRNAME = ".packs"
+INDEX_DTYPE = np.dtype(
+    [("hash", "<u8"), ("pack", "<u4"), ("offset", "<u8"), ("length", "<u4")]
+)
+
+
+def _key(path):
+    return path.replace(os.sep, "/").encode("utf-8")
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+class PackStore:
+    """Packed artifacts, read through a memory mapped offset index.
+
+    Packs are append-only and there may be only one writer at a time, but any
+    number of readers. A reader that misses a key reloads the index if a
+    writer has replaced it since it was loaded.
+    """
+
+    def __init__(self, root, n_shards=256):
+        """
+        Parameters
+        ----------
+        root : str
+            The artifacts directory.
+        n_shards : int, optional
+            Number of pack files to spread packages across, used only when
+            the store is created.
+        """
+        self.root = root
+        self.dirname = os.path.join(root, PACKS_DIRNAME)
+        self.index_file = os.path.join(self.dirname, "index.npy")
+        meta_file = os.path.join(self.dirname, "meta.json")
+        if os.path.isfile(meta_file):
+            with open(meta_file) as f:
+                n_shards = json.load(f)["n_shards"]
+        self.n_shards = n_shards
+        self._meta_file = meta_file
+        self._index = np.empty(0, dtype=INDEX_DTYPE)
+        self._index_stat = None
+        self._maps = {}
+        self.refresh()
+
+    def __repr__(self):
+        return f"PackStore({self.root!r})"
+
+    @staticmethod
+    def exists(root):
+        """Whether an artifacts directory has a pack store."""
+        return os.path.isfile(os.path.join(root, PACKS_DIRNAME, "index.npy"))
+
+    def refresh(self):
+        """Reloads the index if it has changed on disk. Returns whether it did."""
+        try:
+            st = os.stat(self.index_file)
+        except FileNotFoundError:
+            return False
+        # the index is replaced rather than rewritten, so the inode changes
+        stat = (st.st_ino, st.st_mtime_ns)
+        if stat == self._index_stat:
+            return False
+        self.close()
+        self._index = np.load(self.index_file, mmap_mode="r")
+        self._index_stat = stat
+        return True
+
+    def close(self):
+        for m in self._maps.values():
+            m.close()
+        self._maps.clear()
+
+    def pack_file(self, pack):
+        return os.path.join(self.dirname, f"pack-{pack:04d}.pack")
+
+    def shard(self, pkg):
+        """Returns the pack number that a package is stored in."""
+        return zlib.crc32(pkg.encode("utf-8")) % self.n_shards
+
+    def _map(self, pack):
+        m = self._maps.get(pack)
+        if m is None:
+            with open(self.pack_file(pack), "rb") as f:
+                m = self._maps[pack] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return m
+
+    def _record(self, pack, offset, length):
+        return self._map(pack)[offset:offset + length]
+
+    def _record_key(self, pack, offset, length):
+        """The key of a record, copying only it out of the pack, rather than
+        the whole record.
+        """
+        m = self._map(pack)
+        end = m.find(b"\n", offset, offset + length)
+        return m[offset:end if end >= 0 else offset + length]
+
+    def _lookup(self, key):
+        hashes = self._index["hash"]
+        h = _hash(key)
+        i = int(np.searchsorted(hashes, h))
+        while i < len(hashes) and hashes[i] == h:
+            pack, offset = int(self._index[i]["pack"]), int(self._index[i]["offset"])
+            length = int(self._index[i]["length"])
+            if self._record_key(pack, offset, length) == key:
+                start = offset + len(key) + 1
+                return pack, offset, self._record(pack, start, length - len(key) - 1)
+            i += 1
+        return None
+
+    def _find(self, path):
+        key = _key(path)
+        found = self._lookup(key)
+        if found is None and self.refresh():
+            found = self._lookup(key)
+        return found
+
+    def get(self, path):
+        """Returns the raw JSON bytes of an artifact, or None if it is not in
+        the store. ``path`` is relative to the artifacts directory.
+        """
+        found = self._find(path)
+        return None if found is None else found[2]
+
+    def locate(self, path):
+        """Returns the ``(pack, offset)`` of an artifact, or None if it is not
+        in the store.
+        """
+        found = self._find(path)
+        return None if found is None else found[:2]
+
+    def load(self, path):
+        """Returns the data of an artifact, or None if it is not in the store."""
+        body = self.get(path)
+        return None if body is None else json.loads(body)
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def __len__(self):
+        return len(self._index)
+
+    def entries(self):
+        """Yields ``(path, pack, offset)`` for all of the artifacts in the
+        store, in index order.
+        """
+        for row in self._index:
+            pack, offset = int(row["pack"]), int(row["offset"])
+            key = self._record_key(pack, offset, int(row["length"]))
+            yield key.decode("utf-8").replace("/", os.sep), pack, offset
+
+    def keys(self):
+        """Yields the paths of all of the artifacts in the store, in index order."""
+        for path, _, _ in self.entries():
+            yield path
+
+    def writer(self):
+        """Returns a ``PackWriter`` for appending to this store."""
+        return PackWriter(self)
+
+    def pack_directory(self, remove=False):
+        """Appends all of the loose artifact files under the root to the store.
+        Artifacts that are already in the store as they are in their files,
+        such as when a directory is packed again, are not appended again.
+
+        Parameters
+        ----------
+        remove : bool, optional
+            Whether to remove each file once its pack has been written.
+
+        Returns
+        -------
+        n : int
+            The number of artifacts appended.
+        """
+        # imported here, since the store module depends on this one
+        from libcflib.store import ZSTD_SUFFIX, read_artifact_file_bytes
+
+        paths = list(walk_artifact_paths(self.root))
+        n = 0
+        with self.writer() as w:
+            for path in paths:
+                raw = read_artifact_file_bytes(self.root, path)
+                found = self._lookup(_key(path))
+                if found is not None and found[2] == raw:
+                    continue
+                w.add_raw(path, raw)
+                n += 1
+        if remove:
+            for path in paths:
+                for filename in [path, path + ZSTD_SUFFIX]:
+                    filename = os.path.join(self.root, filename)
+                    if os.path.exists(filename):
+                        os.remove(filename)
+        return n
+
+
+class PackWriter:
+    """Appends artifacts to the packs of a ``PackStore``. The new index is
+    only written out, atomically, when the writer is closed, so readers see
+    either none or all of the artifacts that it added.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.files = {}
+        self.entries = {}
+        os.makedirs(store.dirname, exist_ok=True)
+        if not os.path.isfile(store._meta_file):
+            with open(store._meta_file, "w") as f:
+                json.dump({"n_shards": store.n_shards}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add_raw(self, path, raw):
+        """Appends the raw JSON bytes of the artifact at ``path``."""
+        key = _key(path)
+        pack = self.store.shard(key.split(b"/", 1)[0].decode("utf-8"))
+        f = self.files.get(pack)
+        if f is None:
+            f = self.files[pack] = open(self.store.pack_file(pack), "ab")
+        record = key + b"\n" + raw
+        self.entries[key] = (pack, f.tell(), len(record))
+        f.write(record)
+
+    def add(self, path, data):
+        """Appends the data of the artifact at ``path``."""
+        self.add_raw(path, json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+
+    def close(self):
+        for f in self.files.values():
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        self.files.clear()
+        if not self.entries:
+            return
+        store = self.store
+        store.refresh()
+        new = np.array(
+            [(_hash(k), p, o, n) for k, (p, o, n) in self.entries.items()],
+            dtype=INDEX_DTYPE,
+        )
+        old = np.asarray(store._index)
+        # drop the old rows of keys that have been rewritten
+        keep = np.ones(len(old), dtype=bool)
+        for i in np.flatnonzero(np.isin(old["hash"], new["hash"])):
+            row = old[i]
+            key = store._record_key(int(row["pack"]), int(row["offset"]), int(row["length"]))
+            if key in self.entries:
+                keep[i] = False
+        index = np.concatenate([old[keep], new])
+        index = index[np.argsort(index["hash"], kind="stable")]
+        tmp = f"{store.index_file}.{os.getpid()}.tmp.npy"
+        np.save(tmp, index)
+        os.replace(tmp, store.index_file)
+        self.entries.clear()
+        store.refresh()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Packs the loose artifact files of an artifacts directory.")
+    parser.add_argument("root", help="the artifacts directory")
+    parser.add_argument("--remove", action="store_true", default=False,
+                        help="remove the artifact files once they are packed")
+    parser.add_argument("--shards", type=int, default=256,
+                        help="number of pack files, when creating the store")
+    ns = parser.parse_args()
+    n = PackStore(ns.root, n_shards=ns.shards).pack_directory(remove=ns.remove)
+    print(f"packed {n} artifacts")
@@ -3,24 +3,34 @@ Generate a list of artifacts to write to an output of some kind for further proc
 """
 
 import json
-import bz2
-import io
 import os
-import glob
-from collections import defaultdict
+import asyncio
+import builtins
+from collections import defaultdict, namedtuple
 from typing import Dict, Set
-import subprocess
+from urllib.parse import urlsplit
 import tempfile
 
-from concurrent.futures import as_completed, ThreadPoolExecutor
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from functools import partial
 
 import requests
+from requests.adapters import HTTPAdapter
 import tqdm
+import urllib3
 
 from .harvester import harvest, harvest_dot_conda
+from .manifest import Manifest
+from .repodata import RepodataCache
+from .store import current_dictionary, dump_artifact
 from .tools import expand_file_and_mkdirs
+from .walker import walk_artifacts
+from .workqueue import ORDERINGS, WorkQueue
 
 
+# packages up to this size are held in memory, larger ones are spilled to disk
+SPOOL_SIZE = 64 * 2**20
+
 channel_list = [
     "https://conda.anaconda.org/conda-forge/linux-64",
     "https://conda.anaconda.org/conda-forge/osx-64",
@@ -32,51 +42,91 @@ channel_list = [
 ]
 
 
-def fetch_arch(arch):
-    # Generate a set a urls to generate for an channel/arch combo
+# An upstream artifact. The first three fields are the package name, the
+# artifact path relative to the package directory and the package url.
+RepodataRecord = namedtuple(
+    "RepodataRecord", ["name", "filename", "url", "size", "timestamp"]
+)
+
+
+def update_arch(arch, cache):
+    """Brings the cached repodata for a channel/arch up to date."""
     print(f"Fetching {arch}", flush=True)
-    r = requests.get(f"{arch}/repodata.json.bz2")
-    repodata = json.load(bz2.BZ2File(io.BytesIO(r.content)))
+    meta = cache.update(arch)
     print(
         "    found %d .conda artifacts" % (
-            len(repodata["packages.conda"])
+            meta["packages.conda"]
         ),
         flush=True,
     )
     print(
         "    found %d .tar.bz2 artifacts" % (
-            len(repodata["packages"])
+            meta["packages"]
         ),
         flush=True,
     )
-    for p, v in repodata["packages.conda"].items():
-        package_url = f"{arch}/{p}"
-        file_name = package_url.replace("https://conda.anaconda.org/", "").replace(
-            ".conda", ".json"
-        )
-        yield v["name"], file_name, package_url
-    for p, v in repodata["packages"].items():
-        package_url = f"{arch}/{p}"
-        file_name = package_url.replace("https://conda.anaconda.org/", "").replace(
-            ".tar.bz2", ".json"
-        )
-        yield v["name"], file_name, package_url
+    return meta
+
+
+def iter_arch(arch, cache):
+    """Streams the records of a channel/arch out of the repodata cache."""
+    for fn, name, size, timestamp in cache.entries(arch):
+        package_url = f"{arch}/{fn}"
+        ext = ".conda" if fn.endswith(".conda") else ".tar.bz2"
+        file_name = package_url.replace("https://conda.anaconda.org/", "")
+        file_name = file_name[: -len(ext)] + ".json"
+        yield RepodataRecord(name, file_name, package_url, size, timestamp)
 
 
-def fetch_upstream() -> Dict[str, Dict[str, str]]:
+def fetch_arch(arch, cache=None):
+    # Generate a set a urls to generate for an channel/arch combo
+    if cache is None:
+        cache = RepodataCache()
+    update_arch(arch, cache)
+    yield from iter_arch(arch, cache)
+
+
+def _update_arch(arch, cache_dir=None):
+    update_arch(arch, RepodataCache(cache_dir))
+    return arch
+
+
+def iter_upstream(channels=channel_list, cache_dir=None, max_workers=None):
+    """Streams the records of all channel subdirs, with bounded memory.
+    The repodata of the subdirs is fetched, decompressed and parsed into the
+    cache concurrently in worker processes, and the records of each subdir
+    are streamed back out of the cache as soon as it is ready.
+    """
+    if max_workers is None:
+        max_workers = len(channels)
+    cache = RepodataCache(cache_dir)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(_update_arch, channel_arch, cache_dir)
+            for channel_arch in channels
+        ]
+        for future in as_completed(futures):
+            yield from iter_arch(future.result(), cache)
+
+
+def fetch_upstream(
+    channels=channel_list, cache_dir=None, max_workers=None
+) -> Dict[str, Dict[str, RepodataRecord]]:
+    """Fetches the records of all channel subdirs, mapping package names to
+    artifact filenames to records. Where an artifact is available both as a
+    .tar.bz2 and as a .conda, the .tar.bz2 is used.
+    """
     package_urls = defaultdict(dict)
-    for channel_arch in channel_list:
-        for package_name, filename, url in fetch_arch(channel_arch):
-            package_urls[package_name][filename] = url
+    for record in iter_upstream(channels, cache_dir=cache_dir, max_workers=max_workers):
+        artifacts = package_urls[record.name]
+        if record.filename not in artifacts or record.url.endswith(".tar.bz2"):
+            artifacts[record.filename] = record
     return package_urls
 
 
 def recursive_ls(root):
-    packages = os.listdir(root)
-    for p in packages:
-        files = glob.glob(f"{root}/{p}/*/*/*.json")
-        for f in files:
-            yield p, f.replace(f"{root}/{p}/", "")
+    for p, channel, arch, name in walk_artifacts(root):
+        yield p, os.path.join(channel, arch, name + ".json")
 
 
 def existing(path, recursive_ls=recursive_ls) -> Dict[str, Set[str]]:
@@ -86,62 +136,133 @@ def existing(path, recursive_ls=recursive_ls) -> Dict[str, Set[str]]:
     return existing_dict
 
 
-def diff(path):
-    missing_files = set()
-    upstream = fetch_upstream()
-    local = existing(path)
-
-    missing_packages = set(upstream.keys()) - set(local.keys())
-    present_packages = set(upstream.keys()) & set(local.keys())
+def default_manifest_file():
+    """The default manifest file, $LIBCFLIB_MANIFEST."""
+    return builtins.__xonsh__.env.get("LIBCFLIB_MANIFEST")
+
+
+def diff(path, manifest=None, upstream=None):
+    """Finds the upstream artifacts that are missing from an artifacts directory.
+
+    Parameters
+    ----------
+    path : str
+        The artifacts directory.
+    manifest : Manifest or None, optional
+        The manifest of the artifacts in path, defaults to the one at
+        $LIBCFLIB_MANIFEST (which is built by walking path, if needed).
+    upstream : iterable of RepodataRecord or None, optional
+        The upstream records, defaults to streaming them with
+        ``iter_upstream()``.
+
+    Returns
+    -------
+    set of RepodataRecord
+        The missing artifacts. Where an artifact is available both as a
+        .tar.bz2 and as a .conda, the .tar.bz2 is used.
+    """
+    if upstream is None:
+        upstream = iter_upstream()
+    own_manifest = manifest is None
+    if own_manifest:
+        manifest = Manifest(default_manifest_file(), root=path)
+    missing_files = {}
+    for record in manifest.missing(upstream):
+        key = (record.name, record.filename)
+        if key not in missing_files or record.url.endswith(".tar.bz2"):
+            missing_files[key] = record
+    if own_manifest:
+        manifest.close()
+    return set(missing_files.values())
 
-    for package in missing_packages:
-        missing_files.update((package, k, v) for k, v in upstream[package].items())
 
-    for package in present_packages:
-        upstream_artifacts = upstream[package]
-        present_artifacts = local[package]
+class ReapFailure(Exception):
+    def __init__(self, package, src_url, msg):
+        super(ReapFailure, self).__init__(package, src_url, msg)
 
-        missing_artifacts = set(upstream_artifacts) - set(present_artifacts)
-        missing_files.update(
-            (package, k, v)
-            for k, v in upstream_artifacts.items()
-            if k in missing_artifacts
-        )
 
-    return missing_files
+class TransientReapFailure(ReapFailure):
+    """A reap failure that may go away on retry, such as a timeout or a 5xx."""
 
 
-class ReapFailure(Exception):
-    def __init__(self, package, src_url, msg):
-        super(ReapFailure, self).__init__(package, src_url, msg)
+def _is_transient(exc):
+    if isinstance(exc, requests.HTTPError):
+        status = exc.response.status_code if exc.response is not None else 500
+        return status == 429 or status >= 500
+    return isinstance(
+        exc, (requests.ConnectionError, requests.Timeout, urllib3.exceptions.HTTPError)
+    )
 
 
-def reap_package(root_path, package, dst_path, src_url, progress_callback=None):
+_SESSION = None
+
+
+def make_session(pool_size=20):
+    """Creates a requests session that keeps a pool of keep-alive connections
+    per host, which may be shared between threads.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session():
+    """Gets the default (lazily created) session for downloading packages."""
+    global _SESSION
+    if _SESSION is None:
+        _SESSION = make_session()
+    return _SESSION
+
+
+def fetch_and_harvest(src_url, session=None, spool_size=SPOOL_SIZE, timeout=60 * 2):
+    """Downloads a package and harvests it without writing it to disk first.
+
+    ``.tar.bz2`` bodies are decompressed straight off of the socket, and the
+    download is abandoned once the ``info/`` directory has been read.
+    ``.conda`` files are zip archives, which need to be seekable, so they are
+    buffered in memory and only spilled to disk above ``spool_size`` bytes.
+    """
+    if session is None:
+        session = get_session()
+    with session.get(src_url, stream=True, timeout=timeout) as resp:
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        if src_url.endswith(".tar.bz2"):
+            return harvest(resp.raw, streaming=True)
+        elif src_url.endswith(".conda"):
+            with tempfile.SpooledTemporaryFile(max_size=spool_size) as filelike:
+                for chunk in resp.iter_content(chunk_size=2**20):
+                    filelike.write(chunk)
+                filelike.seek(0)
+                return harvest_dot_conda(filelike, src_url)
+        else:
+            raise RuntimeError(f"File '{src_url}' is not a recognized conda format!")
+
+
+def reap_package(
+    root_path,
+    package,
+    dst_path,
+    src_url,
+    progress_callback=None,
+    session=None,
+    compress=False,
+):
     if progress_callback:
         progress_callback()
     try:
-        # resp = requests.get(src_url, timeout=60 * 2)
-        # filelike = io.BytesIO(resp.content)
-        with tempfile.TemporaryDirectory() as tmpdir:
-            subprocess.run(
-                f"cd {tmpdir} && wget --quiet {src_url}",
-                shell=True,
-                check=True,
-            )
-            pkg_pth = os.path.join(tmpdir, os.path.basename(src_url))
-            with open(pkg_pth, "rb") as filelike:
-                if pkg_pth.endswith(".tar.bz2"):
-                    harvested_data = harvest(filelike)
-                elif pkg_pth.endswith(".conda"):
-                    harvested_data = harvest_dot_conda(filelike, pkg_pth)
-                else:
-                    raise RuntimeError(f"File '{pkg_pth}' is not a recognized conda format!")
-        with open(
-            expand_file_and_mkdirs(os.path.join(root_path, package, dst_path)), "w"
-        ) as fo:
-            json.dump(harvested_data, fo, indent=1, sort_keys=True)
+        harvested_data = fetch_and_harvest(src_url, session=session)
+        dump_artifact(
+            harvested_data,
+            expand_file_and_mkdirs(os.path.join(root_path, package, dst_path)),
+            compress=compress,
+            zstd_dict=current_dictionary(root_path) if compress else None,
+        )
     except Exception as e:
-        raise ReapFailure(package, src_url, str(e))
+        failure = TransientReapFailure if _is_transient(e) else ReapFailure
+        raise failure(package, src_url, str(e))
     channel, arch, name = dst_path.split(os.sep)
     name = os.path.splitext(name)[0]
     harvested_data.update(
@@ -156,32 +277,190 @@ def reap_package(root_path, package, dst_path, src_url, progress_callback=None):
     return harvested_data
 
 
-def reap(path, known_bad_packages=()):
-    sorted_files = list(diff(path))
-    print(f"TOTAL OUTSTANDING ARTIFACTS: {len(sorted_files)}")
-    sorted_files = sorted_files[:1000]
+async def reap_async(
+    path,
+    artifacts,
+    executor=None,
+    concurrency=20,
+    per_host=20,
+    retries=3,
+    backoff=1.0,
+    callback=None,
+    compress=False,
+):
+    """Reaps many artifacts concurrently.
+
+    Parameters
+    ----------
+    path : str
+        The artifacts directory to write into.
+    artifacts : iterable of (package, dst, src_url, ...) tuples
+        The artifacts to reap, such as ``RepodataRecord`` instances.
+    executor : concurrent.futures.Executor or None, optional
+        Where ``reap_package()`` is run. This should be a process pool, since
+        harvesting is CPU-bound. None means the event loop's default executor.
+    concurrency : int, optional
+        Maximum number of artifacts being reaped at once.
+    per_host : int, optional
+        Maximum number of artifacts being fetched from any one host at once.
+    retries : int, optional
+        How many times to retry artifacts that fail with a
+        ``TransientReapFailure``.
+    backoff : float, optional
+        Seconds to wait before the first retry, doubling after each attempt.
+    callback : callable or None, optional
+        Called as ``callback(artifact, exc)`` when each artifact is finished,
+        where ``exc`` is the ``ReapFailure`` or None on success.
+    compress : bool, optional
+        Whether to write the artifacts zstd compressed, with the current
+        dictionary of the artifacts directory if it has one.
+
+    Returns
+    -------
+    failures : list of ReapFailure
+        The artifacts that could not be reaped.
+    """
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(concurrency)
+    host_limits = defaultdict(lambda: asyncio.Semaphore(per_host))
+    failures = []
+
+    async def reap_one(artifact):
+        package, dst, src_url = artifact[:3]
+        host = urlsplit(src_url).netloc
+        for attempt in range(retries + 1):
+            # take the host slot first, so that a saturated host does not
+            # starve the others of global slots
+            async with host_limits[host], limit:
+                try:
+                    await loop.run_in_executor(
+                        executor,
+                        partial(reap_package, compress=compress),
+                        path,
+                        package,
+                        dst,
+                        src_url,
+                    )
+                except TransientReapFailure as e:
+                    exc = e
+                except ReapFailure as e:
+                    exc = e
+                    break
+                except Exception as e:
+                    exc = ReapFailure(package, src_url, repr(e))
+                    break
+                else:
+                    exc = None
+                    break
+            if attempt < retries:
+                await asyncio.sleep(backoff * 2**attempt)
+        if exc is not None:
+            failures.append(exc)
+        if callback is not None:
+            callback(artifact, exc)
+
+    await asyncio.gather(*[reap_one(artifact) for artifact in artifacts])
+    return failures
+
+
+def default_queue_file():
+    """The default work queue file, $LIBCFLIB_REAP_QUEUE."""
+    return builtins.__xonsh__.env.get("LIBCFLIB_REAP_QUEUE")
+
+
+def reap(
+    path,
+    known_bad_packages=(),
+    batch_size=1000,
+    concurrency=20,
+    per_host=20,
+    retries=3,
+    queue=None,
+    order="name",
+    refresh=False,
+    retry_failed=False,
+    manifest=None,
+    rebuild_manifest=False,
+    compress=False,
+):
+    """Reaps a batch of the artifacts that are missing from the path, returning
+    the list of ``ReapFailure`` exceptions for those that could not be reaped.
+
+    When a work queue file is given, the outstanding artifacts are kept in it
+    between runs, so that a restarted (or crashed) run picks up where the last
+    one stopped. Upstream is only diffed again once the queue is drained, or
+    if ``refresh`` is True. ``order`` is one of ``workqueue.ORDERINGS``, and
+    ``retry_failed`` puts the artifacts that failed in earlier runs back in
+    the queue.
+
+    What has already been reaped is tracked in a manifest file (defaulting to
+    $LIBCFLIB_MANIFEST), which is updated as each artifact is written. It is
+    built by walking the path the first time, or if ``rebuild_manifest``
+    is True.
+
+    Artifacts are written as zstd compressed ``.json.zst`` files if
+    ``compress`` is True.
+    """
+    if manifest is None:
+        manifest = default_manifest_file()
+    manifest = Manifest(manifest, root=path)
+    if rebuild_manifest:
+        manifest.rebuild(path)
+    if queue is None:
+        sorted_files = list(diff(path, manifest=manifest))
+        print(f"TOTAL OUTSTANDING ARTIFACTS: {len(sorted_files)}")
+        sorted_files = [
+            f for f in sorted_files[:batch_size] if f.url not in known_bad_packages
+        ]
+        wq = None
+    else:
+        wq = WorkQueue(queue)
+        recovered = wq.recover()
+        if recovered:
+            print(f"RECOVERED {recovered} IN-FLIGHT ARTIFACTS")
+        if retry_failed:
+            print(f"RETRYING {wq.retry_failed()} FAILED ARTIFACTS")
+        if refresh or not wq.counts()[wq.PENDING]:
+            print(f"ADDED {wq.add(diff(path, manifest=manifest))} ARTIFACTS TO THE QUEUE")
+        print(f"TOTAL OUTSTANDING ARTIFACTS: {wq.counts()[wq.PENDING]}")
+        sorted_files = []
+        for f in wq.claim(batch_size, order=order):
+            if f[2] in known_bad_packages:
+                wq.mark_failed(f[2], "known bad package")
+            else:
+                sorted_files.append(f)
     progress = tqdm.tqdm(total=len(sorted_files))
 
-    with ThreadPoolExecutor(max_workers=20) as pool:
-        futures = [
-            pool.submit(
-                reap_package,
+    def callback(artifact, exc):
+        progress.update()
+        if exc is None:
+            manifest.add(os.path.join(artifact[0], artifact[1]))
+        else:
+            print(f"FAILURE {exc.args}")
+        if wq is not None:
+            if exc is None:
+                wq.mark_done(artifact[2])
+            else:
+                wq.mark_failed(artifact[2], exc.args[2])
+
+    with ProcessPoolExecutor(max_workers=concurrency) as pool:
+        failures = asyncio.run(
+            reap_async(
                 path,
-                package,
-                dst,
-                src_url,
-                progress_callback=progress.update,
+                sorted_files,
+                executor=pool,
+                concurrency=concurrency,
+                per_host=per_host,
+                retries=retries,
+                callback=callback,
+                compress=compress,
             )
-            for package, dst, src_url in sorted_files
-            if (src_url not in known_bad_packages)
-        ]
-        for f in as_completed(futures):
-            try:
-                f.result()
-            except ReapFailure as e:
-                print(f"FAILURE {e.args}")
-            except Exception:
-                pass
+        )
+    progress.close()
+    manifest.close()
+    if wq is not None:
+        wq.close()
+    return failures
 
 
 if __name__ == "__main__":
@@ -193,6 +472,73 @@ if __name__ == "__main__":
         "--known-bad-packages",
         help="name of a json file containing a list of urls to be skipped",
     )
+    parser.add_argument(
+        "--failures",
+        help="name of a json file to write the list of urls that failed to",
+    )
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=20,
+        help="maximum number of artifacts to reap at once",
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        default=20,
+        help="maximum number of concurrent downloads from a single host",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="number of retries for transient failures",
+    )
+
+    parser.add_argument(
+        "--queue",
+        default=default_queue_file(),
+        help="work queue file to resume from, defaults to $LIBCFLIB_REAP_QUEUE",
+    )
+    parser.add_argument(
+        "--no-queue",
+        dest="queue",
+        action="store_const",
+        const=None,
+        help="reap straight from the upstream diff, without a work queue",
+    )
+    parser.add_argument(
+        "--order",
+        default="name",
+        choices=sorted(ORDERINGS),
+        help="order in which queued artifacts are reaped",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="add newly missing artifacts to the queue, even if it is not drained",
+    )
+    parser.add_argument(
+        "--manifest",
+        default=default_manifest_file(),
+        help="manifest of the reaped artifacts, defaults to $LIBCFLIB_MANIFEST",
+    )
+    parser.add_argument(
+        "--rebuild-manifest",
+        action="store_true",
+        help="rebuild the manifest by walking the artifacts directory",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="put artifacts that failed in earlier runs back in the queue",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="write zstd compressed artifacts, see 'python -m libcflib.store train'",
+    )
 
     args = parser.parse_args()
     print(args)
@@ -202,4 +548,21 @@ if __name__ == "__main__":
     else:
         known_bad_packages = set()
 
-    reap(args.root_path, known_bad_packages)
+    failures = reap(
+        args.root_path,
+        known_bad_packages,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        per_host=args.per_host,
+        retries=args.retries,
+        queue=args.queue,
+        order=args.order,
+        refresh=args.refresh,
+        retry_failed=args.retry_failed,
+        manifest=args.manifest,
+        rebuild_manifest=args.rebuild_manifest,
+        compress=args.compress,
+    )
+    if args.failures:
+        with open(args.failures, "w") as fo:
+            json.dump(sorted(e.args[1] for e in failures), fo, indent=1)
@@ -0,0 +1,250 @@
+"""Fetching, streaming and caching of channel repodata."""
+import bz2
+import io
+import json
+import os
+import pickle
+import builtins
+import hashlib
+
+import requests
+
+try:
+    import compression.zstd as zstd  # Python 3.14+
+except ImportError:
+    try:
+        import backports.zstd as zstd
+    except ImportError:
+        zstd = None
+
+from libcflib.tools import expand_and_make_dir
+
+PACKAGE_KEYS = ("packages", "packages.conda")
+
+# number of entries in each pickle frame of a cache file
+FRAME_SIZE = 10_000
+
+
+class _JSONStream:
+    """A minimal pull parser over a text stream, which is only ever holding
+    the current JSON value (plus a chunk) in memory.
+    """
+
+    def __init__(self, fileobj, chunk_size=2**16):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.pending = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.fileobj.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Returns the next non-whitespace character, without consuming it."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("unexpected end of JSON stream")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"expected {char!r} at {self.buf[self.pos:self.pos + 20]!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decodes the next complete JSON value."""
+        self.pending = False
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+    def items(self):
+        """Yields the (key, value) pairs of an object, one at a time. The
+        value must be consumed (with ``value()`` or ``items()``) before the
+        next pair is requested; it is only consumed here if it was not.
+        """
+        self.pending = False
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            self.pending = True
+            yield key, self
+            if self.pending:
+                # the consumer skipped the value
+                self.value()
+            if self.peek() == ",":
+                self.pos += 1
+            else:
+                self.expect("}")
+                return
+
+
+def iter_repodata(fileobj, chunk_size=2**16):
+    """Streams the package entries out of a repodata.json text stream, with
+    memory bounded by the size of an entry rather than of the whole file.
+
+    Yields
+    ------
+    key : str
+        ``"packages"`` or ``"packages.conda"``.
+    fn : str
+        The artifact filename.
+    info : dict
+        The package record.
+    """
+    stream = _JSONStream(fileobj, chunk_size=chunk_size)
+    for key, _ in stream.items():
+        if key not in PACKAGE_KEYS:
+            continue
+        for fn, _ in stream.items():
+            yield key, fn, stream.value()
+
+
+def open_repodata(fileobj, fmt):
+    """Opens a compressed repodata binary stream as a decompressed text stream."""
+    if fmt == ".zst":
+        decompressed = zstd.open(fileobj)
+    else:
+        decompressed = bz2.BZ2File(fileobj)
+    return io.TextIOWrapper(decompressed, encoding="utf-8")
+
+
+class RepodataCache:
+    """A local cache of repodata, keyed by subdir URL. It stores the ETag and
+    Last-Modified headers of each response and sends conditional requests, so
+    that unchanged repodata is neither downloaded nor parsed again.
+    ``repodata.json.zst`` is preferred over ``repodata.json.bz2`` when the
+    server has it and a zstd module is available.
+
+    Only the parts of each package record that are needed for reaping are
+    kept, as ``(fn, name, size, timestamp)`` entries. These are parsed from the
+    response as it streams in, and written out in frames, so neither fetching
+    nor reading the cache ever holds a whole subdir in memory.
+    """
+
+    def __init__(self, cache_dir=None, session=None, timeout=60 * 5):
+        """
+        Parameters
+        ----------
+        cache_dir : str or None, optional
+            The cache directory, defaults to $LIBCFLIB_REPODATA_CACHE.
+        session : requests.Session or None, optional
+            Session to fetch with.
+        timeout : float, optional
+            Timeout for each request, in seconds.
+        """
+        if cache_dir is None:
+            cache_dir = builtins.__xonsh__.env.get("LIBCFLIB_REPODATA_CACHE")
+        self.cache_dir = expand_and_make_dir(cache_dir)
+        self.session = requests.Session() if session is None else session
+        self.timeout = timeout
+        self.formats = (".zst", ".bz2") if zstd is not None else (".bz2",)
+
+    def __repr__(self):
+        return f"RepodataCache({self.cache_dir!r})"
+
+    def _filenames(self, subdir_url):
+        key = hashlib.sha1(subdir_url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + ".json", base + ".pkl"
+
+    def meta(self, subdir_url):
+        """Returns the cached metadata for a subdir URL, which includes the
+        number of ``"packages"`` and ``"packages.conda"`` entries, or an
+        empty dict if it has not been cached.
+        """
+        meta_file, data_file = self._filenames(subdir_url)
+        if not (os.path.isfile(meta_file) and os.path.isfile(data_file)):
+            return {}
+        with open(meta_file) as f:
+            return json.load(f)
+
+    def _store(self, subdir_url, url, resp, fmt):
+        meta_file, data_file = self._filenames(subdir_url)
+        meta = {
+            "url": url,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+        }
+        meta.update(dict.fromkeys(PACKAGE_KEYS, 0))
+        # write then rename, so that concurrent readers never see partial files
+        tmp = f"{data_file}.{os.getpid()}.tmp"
+        resp.raw.decode_content = True
+        with open(tmp, "wb") as f, open_repodata(resp.raw, fmt) as text:
+            frame = []
+            for key, fn, info in iter_repodata(text):
+                meta[key] += 1
+                frame.append((fn, info["name"], info.get("size", 0), info.get("timestamp", 0)))
+                if len(frame) == FRAME_SIZE:
+                    pickle.dump(frame, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    frame = []
+            if frame:
+                pickle.dump(frame, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, data_file)
+        tmp = f"{meta_file}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_file)
+        return meta
+
+    def update(self, subdir_url):
+        """Brings the cache for a channel subdir URL, such as
+        ``https://conda.anaconda.org/conda-forge/noarch``, up to date with
+        upstream and returns its metadata.
+        """
+        meta = self.meta(subdir_url)
+        for fmt in self.formats:
+            url = f"{subdir_url}/repodata.json{fmt}"
+            headers = {}
+            if meta.get("url") == url:
+                if meta.get("etag"):
+                    headers["If-None-Match"] = meta["etag"]
+                if meta.get("last_modified"):
+                    headers["If-Modified-Since"] = meta["last_modified"]
+            with self.session.get(
+                url, headers=headers, timeout=self.timeout, stream=True
+            ) as r:
+                if r.status_code == 304:
+                    return meta
+                elif r.status_code == 404 and fmt != self.formats[-1]:
+                    continue
+                r.raise_for_status()
+                return self._store(subdir_url, url, r, fmt)
+
+    def entries(self, subdir_url):
+        """Streams the cached ``(fn, name, size, timestamp)`` entries of a
+        subdir URL, in repodata order.
+        """
+        with open(self._filenames(subdir_url)[1], "rb") as f:
+            while True:
+                try:
+                    frame = pickle.load(f)
+                except EOFError:
+                    return
+                yield from frame
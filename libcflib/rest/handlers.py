@@ -42,7 +42,7 @@ class Package(RequestHandler):
 
     def get(self, *args, **kwargs):
         """GETs the packages dict"""
-        self.write(self.db.packages[self.data("pkg")])
+        self.write(self.db.packages[self.data["pkg"]])
 
 
 class Search(RequestHandler):
@@ -52,6 +52,7 @@ class Search(RequestHandler):
         "query": NON_EMPTY_STR.copy(),
         "page_num": {"type": "integer", "required": False, 'min': 1},
         "page_size": {"type": "integer", "required": False, 'min': 1},
+        "cursor": {"type": "string", "required": False, "empty": False},
     }
     defaults = {
         "page_num": 1,
@@ -63,11 +64,81 @@ class Search(RequestHandler):
     }
 
     def get(self, *args, **kwargs):
-        res = {"results": list(self.db.search(**self.data))}
+        try:
+            results, next_cursor = self.db.search_page(**self.data)
+        except ValueError as e:
+            self.send_error(400, message=str(e))
+            return
+        res = {"results": results, "next_cursor": next_cursor}
         res.update(self.data)
         self.write(res)
 
 
+GRAPH_SCHEMA = {
+    "pkg": NON_EMPTY_STR.copy(),
+    "channel": {"type": "string", "empty": False, "required": False},
+    "depth": {"type": "integer", "required": False, "min": 0},
+    "arch": {"type": "string", "empty": False, "required": False},
+}
+
+
+class GraphQuery(RequestHandler):
+    """Base class for queries of a channel graph about a package, which call
+    the ``CSRGraph`` method named by ``method``. ``arch`` may be a comma
+    separated list of arches.
+    """
+
+    schema = GRAPH_SCHEMA
+    defaults = {"channel": "conda-forge"}
+    converters = {"depth": int}
+    result_key = None
+    method = None
+
+    def get(self, *args, **kwargs):
+        channel, pkg = self.data["channel"], self.data["pkg"]
+        graph = self.db.graph(channel)
+        if graph is None:
+            self.send_error(404, message=f"no graph for channel {channel!r}")
+            return
+        elif pkg not in graph:
+            self.send_error(404, message=f"{pkg!r} is not in the {channel!r} graph")
+            return
+        arch = self.data.get("arch")
+        arch = None if arch is None else arch.split(",")
+        query = getattr(graph, self.method)
+        res = {self.result_key: query(pkg, max_depth=self.data.get("depth"), arch=arch)}
+        res.update(self.data)
+        self.write(res)
+
+
+class Dependencies(GraphQuery):
+    """Gets the transitive dependencies of a package, with how many levels
+    down each one is.
+    """
+
+    route = "/dependencies"
+    result_key = "dependencies"
+    method = "dependency_closure"
+
+
+class Dependents(GraphQuery):
+    """Gets the packages that transitively depend on a package, with how
+    many levels up each one is.
+    """
+
+    route = "/dependents"
+    result_key = "dependents"
+    method = "dependent_closure"
+
+
+class RebuildOrder(GraphQuery):
+    """Gets the stages to rebuild a package and its dependents in."""
+
+    route = "/rebuild-order"
+    result_key = "order"
+    method = "rebuild_order"
+
+
 class Version(RequestHandler):
     """Gets the version of libcflib"""
 
@@ -43,12 +43,16 @@ def make_parser():
 
 
 class DbUpdater(Thread):
-    """Updates the database every so often."""
+    """Updates the database every so often. Each update is prepared in a
+    snapshot of the graph that is not being read from, and then swapped in
+    on the IOLoop, between requests.
+    """
 
-    def __init__(self, db, freq=3600):
+    def __init__(self, db, freq=3600, ioloop=None):
         super().__init__()
         self.db = db
         self.freq = freq
+        self.ioloop = tornado.ioloop.IOLoop.current() if ioloop is None else ioloop
         self.keep_running = True
         self.daemon = True
         self.start()
@@ -56,7 +60,13 @@ class DbUpdater(Thread):
     def run(self):
         while self.keep_running:
             time.sleep(self.freq)
-            self.db.update_graph()
+            try:
+                snapshot = self.db.prepare_snapshot()
+            except Exception as e:
+                LOGGER.log("failed to update graph: " + repr(e), category="db")
+                continue
+            if snapshot is not None:
+                self.ioloop.add_callback(self.db.swap_snapshot, snapshot)
 
 
 def run_application(ns):
@@ -68,6 +78,7 @@ def run_application(ns):
             isinstance(var, type)
             and var is not RequestHandler
             and issubclass(var, RequestHandler)
+            and var.route is not None
         ):
             handlers.append((var.route, var))
     # init the database
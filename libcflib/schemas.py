@@ -141,9 +141,9 @@ SCHEMAS = {
                     "version": {"type": "string"},
                 },
                 "type": "dict",
-                "stored": False,
+                "stored": True,
             },
-            "name": {"type": "string", "stored": False},
+            "name": {"type": "string", "stored": True},
             "metadata_version": {"type": "integer", "stored": False},
             "raw_recipe": {"type": "string", "stored": False},
             "rendered_recipe": {
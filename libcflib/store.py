@@ -0,0 +1,313 @@
+"""Tools for reading and writing artifact files in the libcfgraph store.
+
+Artifacts may be stored as plain ``<name>.json`` files, as zstd compressed
+``<name>.json.zst`` files, or in the pack store. They are always addressed by
+their ``.json`` path. Compressed artifacts may be written with a dictionary
+trained on the artifacts directory, which is kept in its ``.zstd-dicts``
+directory and found again from the dictionary ID in each frame.
+"""
+import json
+import os
+import random
+
+try:
+    import compression.zstd as zstd  # Python 3.14+
+except ImportError:
+    try:
+        import backports.zstd as zstd
+    except ImportError:
+        zstd = None
+
+from libcflib.packstore import PackStore
+from libcflib.walker import walk_artifacts, walk_artifact_paths
+
+ZSTD_SUFFIX = ".zst"
+ZSTD_LEVEL = 10
+DICTS_DIRNAME = ".zstd-dicts"
+DICT_SIZE = 110 * 2**10
+
+# open pack stores, by artifacts directory
+PACKSTORES = {}
+# loaded zstd dictionaries, by (artifacts directory, dictionary ID)
+DICTIONARIES = {}
+
+
+def _require_zstd():
+    if zstd is None:
+        raise RuntimeError(
+            "compressed artifacts need a zstd module, please install backports.zstd"
+        )
+
+
+def artifact_path(pkg, channel, arch, name):
+    """Returns the path of an artifact file, relative to the artifacts directory."""
+    return os.path.join(pkg, channel, arch, name + ".json")
+
+
+def dumps_artifact(data):
+    """Returns harvested artifact data in the canonical libcfgraph form, as bytes."""
+    return json.dumps(data, indent=1, sort_keys=True).encode("utf-8")
+
+
+def dump_artifact(data, filename, compress=False, zstd_dict=None):
+    """Writes harvested artifact data to a file, in the canonical libcfgraph form.
+
+    Parameters
+    ----------
+    data : dict
+        The artifact data.
+    filename : str
+        The ``.json`` filename of the artifact.
+    compress : bool, optional
+        Whether to write it zstd compressed, to ``filename + ".zst"``.
+    zstd_dict : ZstdDict or None, optional
+        Dictionary to compress with, see ``current_dictionary()``.
+    """
+    if compress:
+        _require_zstd()
+        raw = zstd.compress(dumps_artifact(data), level=ZSTD_LEVEL, zstd_dict=zstd_dict)
+        with open(filename + ZSTD_SUFFIX, "wb") as fo:
+            fo.write(raw)
+    else:
+        with open(filename, "w") as fo:
+            json.dump(data, fo, indent=1, sort_keys=True)
+
+
+def _dicts_dir(root):
+    return os.path.join(root, DICTS_DIRNAME)
+
+
+def get_dictionary(root, dict_id):
+    """Returns a zstd dictionary of an artifacts directory by its ID."""
+    key = (root, dict_id)
+    if key not in DICTIONARIES:
+        with open(os.path.join(_dicts_dir(root), f"{dict_id}.dict"), "rb") as f:
+            DICTIONARIES[key] = zstd.ZstdDict(f.read())
+    return DICTIONARIES[key]
+
+
+def current_dictionary(root):
+    """Returns the zstd dictionary that new artifacts in a directory are
+    compressed with, or None if one has not been trained.
+    """
+    try:
+        with open(os.path.join(_dicts_dir(root), "current")) as f:
+            dict_id = int(f.read())
+    except FileNotFoundError:
+        return None
+    return get_dictionary(root, dict_id)
+
+
+def train_dictionary(root, n_samples=5000, dict_size=DICT_SIZE, seed=None):
+    """Trains a zstd dictionary on a random sample of the artifacts in a
+    directory, and makes it the one that new artifacts are compressed with.
+    Artifacts compressed with earlier dictionaries can still be read.
+
+    Parameters
+    ----------
+    root : str
+        The artifacts directory.
+    n_samples : int, optional
+        Maximum number of artifacts to train on.
+    dict_size : int, optional
+        Maximum size of the dictionary, in bytes.
+    seed : int or None, optional
+        Seed for picking the sample.
+
+    Returns
+    -------
+    ZstdDict
+        The new dictionary.
+    """
+    _require_zstd()
+    paths = list(iter_artifact_paths(root))
+    paths = random.Random(seed).sample(paths, min(n_samples, len(paths)))
+    zstd_dict = zstd.train_dict([read_artifact_bytes(root, p) for p in paths], dict_size)
+    dicts_dir = _dicts_dir(root)
+    os.makedirs(dicts_dir, exist_ok=True)
+    with open(os.path.join(dicts_dir, f"{zstd_dict.dict_id}.dict"), "wb") as f:
+        f.write(zstd_dict.dict_content)
+    tmp = os.path.join(dicts_dir, f"current.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        f.write(str(zstd_dict.dict_id))
+    os.replace(tmp, os.path.join(dicts_dir, "current"))
+    DICTIONARIES[(root, zstd_dict.dict_id)] = zstd_dict
+    return zstd_dict
+
+
+def decompress_artifact(root, raw):
+    """Decompresses the bytes of a compressed artifact of a directory."""
+    _require_zstd()
+    dict_id = zstd.get_frame_info(raw).dictionary_id
+    zstd_dict = get_dictionary(root, dict_id) if dict_id else None
+    return zstd.decompress(raw, zstd_dict=zstd_dict)
+
+
+def get_packstore(root):
+    """Returns the pack store of an artifacts directory, or None if it does
+    not have one. Stores are opened once per process.
+    """
+    packs = PACKSTORES.get(root)
+    if packs is None and PackStore.exists(root):
+        packs = PACKSTORES[root] = PackStore(root)
+    return packs
+
+
+def read_artifact_bytes(root, path):
+    """Returns the uncompressed JSON bytes of an artifact, from the pack store
+    of the artifacts directory if it has one and the artifact is packed, and
+    otherwise from its plain or compressed file.
+
+    Parameters
+    ----------
+    root : str
+        The artifacts directory.
+    path : str
+        The ``.json`` path of the artifact, relative to ``root``.
+    """
+    packs = get_packstore(root)
+    if packs is not None:
+        raw = packs.get(path)
+        if raw is not None:
+            return raw
+    return read_artifact_file_bytes(root, path)
+
+
+def read_artifact_file_bytes(root, path):
+    """Returns the uncompressed JSON bytes of an artifact from its plain or
+    compressed file, even if it is also in the pack store.
+    """
+    filename = os.path.join(root, path)
+    try:
+        with open(filename, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        with open(filename + ZSTD_SUFFIX, "rb") as f:
+            raw = f.read()
+    return decompress_artifact(root, raw)
+
+
+def load_artifact(root, path):
+    """Loads the data of an artifact, wherever it is stored.
+
+    Parameters
+    ----------
+    root : str
+        The artifacts directory.
+    path : str
+        The ``.json`` path of the artifact, relative to ``root``.
+
+    Returns
+    -------
+    dict
+        The data from the artifact.
+    """
+    return json.loads(read_artifact_bytes(root, path))
+
+
+def load_artifact_file(filename):
+    """Loads the data of an artifact from its ``.json`` filename, which must
+    be ``<artifacts dir>/<pkg>/<channel>/<arch>/<name>.json``, even if the
+    artifact is compressed or packed.
+    """
+    root, parts = filename, []
+    for _ in range(4):
+        root, tail = os.path.split(root)
+        parts.append(tail)
+    return load_artifact(root, os.path.join(*reversed(parts)))
+
+
+def iter_artifact_paths(root):
+    """Yields the paths of all of the artifacts in an artifacts directory,
+    whether they are plain, compressed or packed.
+    """
+    seen = set()
+    for path in walk_artifact_paths(root):
+        seen.add(path)
+        yield path
+    packs = get_packstore(root)
+    if packs is not None:
+        for path in packs.keys():
+            if path not in seen:
+                yield path
+
+
+def iter_artifact_stamps(root):
+    """Yields ``(path, stamp)`` for all of the artifacts in an artifacts
+    directory, where the stamp is a string that changes whenever the artifact
+    is rewritten. It is made from the size and mtime of artifact files, and
+    from the location of packed artifacts.
+    """
+    seen = set()
+    for pkg, channel, arch, name, size, mtime in walk_artifacts(root, with_stat=True):
+        path = artifact_path(pkg, channel, arch, name)
+        seen.add(path)
+        yield path, f"{size}:{mtime!r}"
+    packs = get_packstore(root)
+    if packs is not None:
+        for path, pack, offset in packs.entries():
+            if path not in seen:
+                yield path, f"pack:{pack}:{offset}"
+
+
+def artifact_stamp(root, path):
+    """Returns the stamp of a single artifact, as from
+    ``iter_artifact_stamps()``, or None if it does not exist.
+    """
+    filename = os.path.join(root, path)
+    for fname in [filename, filename + ZSTD_SUFFIX]:
+        try:
+            st = os.stat(fname)
+        except FileNotFoundError:
+            continue
+        return f"{st.st_size}:{st.st_mtime!r}"
+    packs = get_packstore(root)
+    location = None if packs is None else packs.locate(path)
+    return None if location is None else "pack:{}:{}".format(*location)
+
+
+def compress_directory(root, remove=True):
+    """Compresses all of the plain artifact files in a directory, with its
+    current dictionary.
+
+    Returns
+    -------
+    n : int
+        The number of artifacts compressed.
+    """
+    _require_zstd()
+    zstd_dict = current_dictionary(root)
+    n = 0
+    for path in walk_artifact_paths(root):
+        filename = os.path.join(root, path)
+        if not os.path.isfile(filename):
+            continue
+        with open(filename, "rb") as f:
+            raw = zstd.compress(f.read(), level=ZSTD_LEVEL, zstd_dict=zstd_dict)
+        with open(filename + ZSTD_SUFFIX, "wb") as f:
+            f.write(raw)
+        if remove:
+            os.remove(filename)
+        n += 1
+    return n
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manages compressed artifacts.")
+    parser.add_argument("command", choices=["train", "compress"],
+                        help="train a new dictionary, or compress the plain artifact files")
+    parser.add_argument("root", help="the artifacts directory")
+    parser.add_argument("--samples", type=int, default=5000,
+                        help="number of artifacts to train the dictionary on")
+    parser.add_argument("--dict-size", type=int, default=DICT_SIZE,
+                        help="maximum size of the dictionary, in bytes")
+    parser.add_argument("--keep", action="store_true", default=False,
+                        help="keep the plain files after compressing them")
+    ns = parser.parse_args()
+    if ns.command == "train":
+        d = train_dictionary(ns.root, n_samples=ns.samples, dict_size=ns.dict_size)
+        print(f"trained dictionary {d.dict_id}")
+    else:
+        print(f"compressed {compress_directory(ns.root, remove=not ns.keep)} artifacts")
@@ -0,0 +1,206 @@
+"""Ordering of conda version strings.
+
+This follows the semantics of conda's ``VersionOrder``: a version is an
+optional ``<epoch>!`` followed by the version proper and an optional
+``+<local version>``. Each of these is split on ``.`` (and ``_``, or ``-`` if
+there are no underscores anywhere in the version) into components, and each
+component into runs of digits and of letters. Numbers compare numerically,
+strings compare below numbers, ``dev`` compares below every other string and
+``post`` above every number. Missing components and parts are treated as
+zero, so that ``1.0`` is the same version as ``1`` and ``1.0a1`` comes before
+``1.0``.
+
+Rather than comparing versions part by part, each one is turned into a
+plain tuple key once, which sorts in the same order and is memoized.
+"""
+import re
+import functools
+
+import numpy as np
+
+# versions that are not valid sort before all others
+INVALID_KEY = (-1, (), ())
+
+_VERSION_RE = re.compile(r"[*.+!_0-9a-z]+")
+_PART_RE = re.compile(r"[0-9]+|[*]+|[^0-9*]+")
+_POST = float("inf")
+
+
+def _parts(component):
+    """The parts of one component, with numbers as ints, ``post`` as infinity
+    and ``dev`` upper cased so that it compares below lower case strings.
+    Components that do not start with a digit get a leading zero, so that
+    ``1.1.post1`` is the same as ``1.1.0post1``.
+    """
+    parts = []
+    for p in _PART_RE.findall(component):
+        if p.isdigit():
+            parts.append(int(p))
+        elif p == "post":
+            parts.append(_POST)
+        elif p == "dev":
+            parts.append("DEV")
+        else:
+            parts.append(p)
+    if not component[:1].isdigit():
+        parts.insert(0, 0)
+    return parts
+
+
+def _encode(items, is_zero, sign, encode_item):
+    """Encodes a sequence, which is padded with zero items when compared, as a
+    tuple that Python compares the same way without padding.
+
+    Trailing zero items are dropped, and each remaining non-zero item is
+    encoded along with the number of zero items before it. An item that
+    compares below zero (a string) is followed by a zero run that sorts it
+    lower, the other way around for items above zero. The sequence ends with
+    ``(0,)``, standing in for the endless zero items after it, which sorts
+    between negative and positive items.
+    """
+    key = []
+    zeros = 0
+    for item in items:
+        if is_zero(item):
+            zeros += 1
+            continue
+        s = sign(item)
+        key.append((s, zeros if s < 0 else -zeros, encode_item(item)))
+        zeros = 0
+    key.append((0,))
+    return tuple(key)
+
+
+def _part_sign(part):
+    return -1 if isinstance(part, str) else 1
+
+
+def _encode_part(part):
+    if isinstance(part, str):
+        return (0, part)
+    return (1, 0) if part == _POST else (0, part)
+
+
+def _component_key(parts):
+    return _encode(parts, lambda p: p == 0, _part_sign, _encode_part)
+
+
+def _component_sign(key):
+    # the sign of the first non-zero part, as encoded by _encode()
+    return key[0][0]
+
+
+def _sequence_key(components):
+    keys = [_component_key(_parts(c)) for c in components]
+    return _encode(keys, lambda k: len(k) == 1, _component_sign, lambda k: k)
+
+
+@functools.lru_cache(maxsize=2**16)
+def version_order_key(version):
+    """Returns a tuple key for a conda version string, so that sorting
+    versions by their keys sorts them as conda's ``VersionOrder`` does.
+    Versions that conda would reject sort before all others, see
+    ``INVALID_KEY``.
+
+    Parameters
+    ----------
+    version : str
+        The version string.
+
+    Returns
+    -------
+    key : tuple
+        ``(epoch, version key, local version key)``.
+    """
+    v = version.strip().lower()
+    if "-" in v and "_" not in v:
+        v = v.replace("-", "_")
+    if not _VERSION_RE.fullmatch(v):
+        return INVALID_KEY
+    epoch, bang, v = v.rpartition("!")
+    if bang:
+        if not epoch.isdigit():
+            return INVALID_KEY
+        epoch = int(epoch)
+    else:
+        epoch = 0
+    v, plus, local = v.partition("+")
+    if not v or "+" in local:
+        return INVALID_KEY
+    # a trailing underscore, as in openssl's 1.0.1_, stays on the text of the
+    # last component, so 1.1_ comes before 1.1a1 and 1.0.2k_ after 1.0.2k
+    if v.endswith("_"):
+        components = v[:-1].replace("_", ".").split(".")
+        components[-1] += "_"
+    else:
+        components = v.replace("_", ".").split(".")
+    local = local.replace("_", ".").split(".") if plus else []
+    if "" in components or "" in local:
+        return INVALID_KEY
+    return (epoch, _sequence_key(components), _sequence_key(local))
+
+
+def version_ranks(versions):
+    """Ranks an array of version strings, so that ``a < b`` for the ranks of
+    two versions exactly when they are in that order. Equal versions, such
+    as ``1.0`` and ``1``, get the same rank. Only the distinct strings are
+    keyed and compared.
+
+    Parameters
+    ----------
+    versions : sequence of str
+        The version strings.
+
+    Returns
+    -------
+    ranks : ndarray of int
+        The rank of each version.
+    """
+    uniq, inverse = np.unique(np.asarray(versions, dtype=object).astype(str), return_inverse=True)
+    keys = [version_order_key(v) for v in uniq]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    ranks = np.empty(len(uniq), dtype=np.int64)
+    rank = -1
+    prev = None
+    for i in order:
+        if keys[i] != prev:
+            rank += 1
+            prev = keys[i]
+        ranks[i] = rank
+    return ranks[inverse.reshape(-1)]
+
+
+def argsort_artifacts(versions, build_numbers, builds, paths=None, groups=None):
+    """Sorts artifacts in the order of ``models.version_key()``, by version,
+    then build number, then build string and then path, with one NumPy
+    lexsort over integer encoded keys. The artifacts may be grouped first.
+
+    Parameters
+    ----------
+    versions : sequence of str
+        The artifact versions.
+    build_numbers : sequence of int
+        The artifact build numbers.
+    builds : sequence of str
+        The artifact build strings.
+    paths : sequence of str or None, optional
+        The artifact paths, for breaking ties.
+    groups : sequence of int or None, optional
+        Group codes, such as package codes, to sort by before anything else.
+
+    Returns
+    -------
+    order : ndarray of int
+        The indices that sort the artifacts, from oldest to latest.
+    """
+    columns = [
+        version_ranks(versions),
+        np.asarray(build_numbers, dtype=np.int64),
+        np.unique(np.asarray(builds, dtype=str), return_inverse=True)[1].reshape(-1),
+    ]
+    if paths is not None:
+        columns.append(np.unique(np.asarray(paths, dtype=str), return_inverse=True)[1].reshape(-1))
+    if groups is not None:
+        columns.insert(0, np.asarray(groups))
+    # lexsort sorts by the last key first
+    return np.lexsort(columns[::-1])
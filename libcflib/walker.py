@@ -0,0 +1,81 @@
+"""A fast walker over the artifacts directory tree, which is laid out as
+``<pkg>/<channel>/<arch>/<name>.json``, or ``<name>.json.zst`` for compressed
+artifacts.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+
+def _subdirs(path):
+    with os.scandir(path) as it:
+        return [e.name for e in it if not e.name.startswith(".") and e.is_dir()]
+
+
+def _scan_package(root, pkg, with_stat=False):
+    entries = []
+    pkg_dir = os.path.join(root, pkg)
+    for channel in _subdirs(pkg_dir):
+        channel_dir = os.path.join(pkg_dir, channel)
+        for arch in _subdirs(channel_dir):
+            names = set()
+            with os.scandir(os.path.join(channel_dir, arch)) as it:
+                for e in it:
+                    if e.name.startswith("."):
+                        continue
+                    elif e.name.endswith(".json"):
+                        name = e.name[:-5]
+                    elif e.name.endswith(".json.zst"):
+                        name = e.name[:-9]
+                    else:
+                        continue
+                    if name in names:
+                        # both the plain and compressed files exist
+                        continue
+                    names.add(name)
+                    if with_stat:
+                        st = e.stat()
+                        entries.append(
+                            (pkg, channel, arch, name, st.st_size, st.st_mtime)
+                        )
+                    else:
+                        entries.append((pkg, channel, arch, name))
+    entries.sort()
+    return entries
+
+
+def walk_artifacts(root, with_stat=False, packages=None, max_workers=16):
+    """Walks an artifacts directory, scanning the package directories in
+    parallel threads (``os.scandir`` releases the GIL while it waits on the
+    filesystem).
+
+    Parameters
+    ----------
+    root : str
+        The artifacts directory.
+    with_stat : bool, optional
+        Whether to also yield the size and mtime of each artifact file.
+    packages : iterable of str or None, optional
+        The packages to walk, defaults to all of them.
+    max_workers : int, optional
+        Number of threads to scan with.
+
+    Yields
+    ------
+    entry : tuple
+        ``(pkg, channel, arch, name)`` where name excludes the .json
+        extension, followed by ``size, mtime`` if ``with_stat`` is True.
+        Entries are sorted within each package, and packages are in order.
+    """
+    if packages is None:
+        packages = sorted(_subdirs(root))
+    scan = partial(_scan_package, root, with_stat=with_stat)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for entries in pool.map(scan, packages):
+            yield from entries
+
+
+def walk_artifact_paths(root, **kwargs):
+    """Yields the paths of all artifacts, relative to the artifacts directory."""
+    for pkg, channel, arch, name in walk_artifacts(root, **kwargs):
+        yield os.path.join(pkg, channel, arch, name + ".json")
@@ -0,0 +1,137 @@
+"""A persistent, on-disk queue of the artifacts waiting to be reaped."""
+import sqlite3
+
+# maps the orderings that the queue may be claimed in to SQL
+ORDERINGS = {
+    "name": "package, dst",
+    "smallest": "size, package, dst",
+    "largest": "size DESC, package, dst",
+    "newest": "timestamp DESC, package, dst",
+    "oldest": "timestamp, package, dst",
+}
+
+
+class WorkQueue:
+    """A SQLite backed queue of artifacts, keyed by their URLs. Each artifact is
+    pending, in-flight, done or failed. Every status change is committed as it
+    happens, so a crashed run loses at most the in-flight artifacts, which are
+    returned to pending by ``recover()``.
+    """
+
+    PENDING = "pending"
+    IN_FLIGHT = "in-flight"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = (PENDING, IN_FLIGHT, DONE, FAILED)
+
+    def __init__(self, filename):
+        """
+        Parameters
+        ----------
+        filename : str
+            Path to the queue file, which is created if needed.
+        """
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                "url TEXT PRIMARY KEY, package TEXT, dst TEXT, size INTEGER, "
+                "timestamp INTEGER, status TEXT, attempts INTEGER, error TEXT)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS artifacts_status ON artifacts (status)"
+            )
+
+    def __repr__(self):
+        return f"WorkQueue({self.filename!r})"
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, records):
+        """Adds (package, dst, url, size, timestamp) records to the queue as
+        pending. Artifacts that are already queued are left alone.
+        Returns the number of newly added artifacts.
+        """
+        rows = (
+            (url, package, dst, size, timestamp, self.PENDING)
+            for package, dst, url, size, timestamp in records
+        )
+        with self.conn:
+            cur = self.conn.executemany(
+                "INSERT OR IGNORE INTO artifacts "
+                "(url, package, dst, size, timestamp, status, attempts) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                rows,
+            )
+        return cur.rowcount
+
+    def claim(self, n, order="name"):
+        """Marks up to n pending artifacts as in-flight, and returns them as a
+        list of (package, dst, url, size, timestamp) tuples.
+        """
+        if order not in ORDERINGS:
+            raise ValueError(f"order must be one of {sorted(ORDERINGS)}, got {order!r}")
+        with self.conn:
+            rows = self.conn.execute(
+                "SELECT package, dst, url, size, timestamp FROM artifacts "
+                f"WHERE status = ? ORDER BY {ORDERINGS[order]} LIMIT ?",
+                (self.PENDING, n),
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE artifacts SET status = ?, attempts = attempts + 1 "
+                "WHERE url = ?",
+                [(self.IN_FLIGHT, row[2]) for row in rows],
+            )
+        return rows
+
+    def _set_status(self, url, status, error=None):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE artifacts SET status = ?, error = ? WHERE url = ?",
+                (status, error, url),
+            )
+
+    def mark_done(self, url):
+        """Marks an artifact as successfully reaped."""
+        self._set_status(url, self.DONE)
+
+    def mark_failed(self, url, error=None):
+        """Marks an artifact as failed, with an optional error message."""
+        self._set_status(url, self.FAILED, error)
+
+    def _move(self, src, dst):
+        with self.conn:
+            cur = self.conn.execute(
+                "UPDATE artifacts SET status = ? WHERE status = ?", (dst, src)
+            )
+        return cur.rowcount
+
+    def recover(self):
+        """Returns in-flight artifacts, left over from a run that stopped
+        early, to pending. Returns the number of recovered artifacts.
+        """
+        return self._move(self.IN_FLIGHT, self.PENDING)
+
+    def retry_failed(self):
+        """Returns failed artifacts to pending, and the number of them."""
+        return self._move(self.FAILED, self.PENDING)
+
+    def counts(self):
+        """Returns a dict of the number of artifacts in each status."""
+        counts = dict.fromkeys(self.STATUSES, 0)
+        counts.update(
+            self.conn.execute("SELECT status, COUNT(*) FROM artifacts GROUP BY status")
+        )
+        return counts
+
+    def failures(self):
+        """Returns a dict mapping the urls of failed artifacts to their errors."""
+        return dict(
+            self.conn.execute(
+                "SELECT url, error FROM artifacts WHERE status = ?", (self.FAILED,)
+            )
+        )
@@ -1,9 +1,14 @@
+import io
 import os
 import sys
 import json
 import shutil
+import tarfile
 import builtins
+import threading
 import subprocess
+import functools
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 
 import pytest
 
@@ -27,6 +32,77 @@ def rmtree(dirname):
             raise
 
 
+def make_tarbz2(dirname, name="mypkg", version="1.0", build="py_0", payload_size=0):
+    """Writes a minimal .tar.bz2 conda package into a directory, with the
+    info/ directory first (as conda-build does) followed by an optional
+    payload of ``payload_size`` bytes. Returns the path to the package.
+    """
+    index = {
+        "name": name,
+        "version": version,
+        "build": build,
+        "build_number": 0,
+        "subdir": "noarch",
+    }
+    members = [
+        ("info/index.json", json.dumps(index).encode()),
+        ("info/about.json", json.dumps({"summary": "a package"}).encode()),
+        ("info/files", b"site-packages/mypkg/__init__.py\n"),
+        ("info/recipe/meta.yaml", f"package:\n  name: {name}\n".encode()),
+        ("site-packages/mypkg/__init__.py", b"x = 1\n"),
+    ]
+    if payload_size:
+        members.append(("site-packages/mypkg/payload.bin", b"\0" * payload_size))
+    filename = os.path.join(dirname, f"{name}-{version}-{build}.tar.bz2")
+    with tarfile.open(filename, "w:bz2") as tf:
+        for arcname, data in members:
+            info = tarfile.TarInfo(arcname)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return filename
+
+
+@pytest.fixture(scope="session")
+def tarbz2_factory():
+    return make_tarbz2
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    # maps request paths to the number of 503s to send before serving them
+    transient_failures = {}
+
+    def do_GET(self):
+        n = self.transient_failures.get(self.path, 0)
+        if n > 0:
+            self.transient_failures[self.path] = n - 1
+            self.send_error(503)
+            return
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def pkg_server(tmpdir):
+    """Serves a temporary directory over HTTP, yields (directory, base url)."""
+    d = tmpdir.mkdir("served")
+    handler = functools.partial(QuietHandler, directory=str(d))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield d, "http://127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+    QuietHandler.transient_failures.clear()
+
+
+@pytest.fixture
+def transient_failures(pkg_server):
+    """Request path to number of 503 responses that pkg_server sends first."""
+    return QuietHandler.transient_failures
+
+
 @pytest.fixture(scope="session")
 def gitecho():
     aliases = builtins.aliases
@@ -0,0 +1,128 @@
+"""Tests building the channel graphs."""
+import os
+import json
+
+import pandas as pd
+import pytest
+
+from libcflib.channel_graphs import (
+    GraphState,
+    build_channel_graphs,
+    build_graph_state,
+    select_latest_artifacts,
+    update_graph_state,
+)
+
+
+def write_artifact(root, pkg, channel, arch, version, requirements):
+    filename = os.path.join(root, pkg, channel, arch, f"{pkg}-{version}-0.json")
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    data = {"version": version, "rendered_recipe": {"requirements": requirements}}
+    with open(filename, "w") as f:
+        json.dump(data, f)
+    return os.path.relpath(filename, root)
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_build_channel_graphs(tmpdir, max_workers):
+    root = str(tmpdir)
+    write_artifact(root, "apkg", "conda-forge", "noarch", "1.0", {"run": ["python >=3.6"]})
+    write_artifact(root, "apkg", "conda-forge", "noarch", "2.0", {"host": ["pip"], "run": ["python"]})
+    write_artifact(root, "bpkg", "conda-forge", "linux-64", "1.0", {"build": None, "run": ["apkg 2.*"]})
+    write_artifact(root, "bpkg", "conda-forge", "osx-64", "1.0", {"run": ["apkg", "libcxx"]})
+    write_artifact(root, "bpkg", "bioconda", "linux-64", "0.1", {})
+    with open(os.path.join(root, "bpkg", "bioconda", "linux-64", "bad.json"), "w") as f:
+        f.write("{")
+    graphs = build_channel_graphs(root, max_workers=max_workers, shard_size=2, progress=False)
+    assert set(graphs) == {"conda-forge", "bioconda"}
+    g = graphs["conda-forge"]
+    assert g.nodes["apkg"] == {
+        "versions": {"1.0", "2.0"},
+        "archs": {"noarch"},
+        "req": {"python", "pip"},
+    }
+    assert g.nodes["bpkg"] == {
+        "versions": {"1.0"},
+        "archs": {"linux-64", "osx-64"},
+        "req": {"apkg", "libcxx"},
+    }
+    assert g.edges["apkg", "bpkg"] == {"arch": {"linux-64", "osx-64"}}
+    assert g.edges["libcxx", "bpkg"] == {"arch": {"osx-64"}}
+    assert g.edges["pip", "apkg"] == {"arch": {"noarch"}}
+    assert set(g.edges) == {("python", "apkg"), ("pip", "apkg"), ("apkg", "bpkg"), ("libcxx", "bpkg")}
+    assert list(graphs["bioconda"].nodes) == ["bpkg"]
+    assert not graphs["bioconda"].edges
+
+
+def graph_data(graphs):
+    return {
+        c: (dict(g.nodes(data=True)), {e: g.edges[e] for e in g.edges})
+        for c, g in graphs.items()
+    }
+
+
+def test_update_graph_state(tmpdir):
+    root = str(tmpdir.mkdir("artifacts"))
+    a1 = write_artifact(root, "apkg", "conda-forge", "noarch", "1.0", {"run": ["python"]})
+    b1 = write_artifact(root, "bpkg", "conda-forge", "linux-64", "1.0", {"run": ["apkg", "zlib"]})
+    b2 = write_artifact(root, "bpkg", "conda-forge", "osx-64", "1.0", {"run": ["apkg"]})
+    c1 = write_artifact(root, "cpkg", "bioconda", "noarch", "1.0", {})
+    state = build_graph_state(root, max_workers=1, progress=False)
+    filename = str(tmpdir.join("state.pkl"))
+    state.save(filename)
+
+    os.remove(os.path.join(root, b1))
+    os.remove(os.path.join(root, c1))
+    write_artifact(root, "apkg", "conda-forge", "noarch", "1.0", {"run": ["python", "numpy"]})
+    a2 = write_artifact(root, "apkg", "conda-forge", "noarch", "2.0", {})
+    state = GraphState.load(filename)
+    assert state.dirty == set()
+    update_graph_state(state, root, [a1, a2, b1, c1])
+    assert state.dirty == {"conda-forge", "bioconda"}
+    assert sorted(state.contributions) == sorted([a1, a2, b2])
+    exp = build_graph_state(root, max_workers=1, progress=False)
+    assert graph_data(state.to_digraphs()) == graph_data(exp.to_digraphs())
+    assert set(state.channels) == {"conda-forge"}
+    g = state.digraph("conda-forge")
+    assert g.nodes["bpkg"] == {"versions": {"1.0"}, "archs": {"osx-64"}, "req": {"apkg"}}
+    assert g.edges["apkg", "bpkg"] == {"arch": {"osx-64"}}
+    assert ("zlib", "bpkg") not in g.edges
+    assert "zlib" not in g
+    assert len(state.digraph("bioconda")) == 0
+
+
+def test_select_latest_artifacts():
+    rows = [
+        # pkg, channel, arch, version, build_number
+        ("apkg", "conda-forge", "linux-64", "1.9", 0),
+        ("apkg", "conda-forge", "linux-64", "1.10", 0),
+        ("apkg", "conda-forge", "linux-64", "1.10a1", 5),
+        ("apkg", "conda-forge", "osx-64", "2.0", 0),
+        ("apkg", "bioconda", "linux-64", "3.0", 0),
+        ("bpkg", "bioconda", "linux-64", "3.0", 0),
+        ("bpkg", "other", "linux-64", "4.0", 0),
+        ("cpkg", "conda-forge", "osx-64", "1.0", 0),
+        ("cpkg", "conda-forge", "osx-64", "1.0", 1),
+        ("cpkg", "conda-forge", "noarch", "1.0", 1),
+        ("cpkg", "conda-forge", "win-64", "1.1", 0),
+        ("dpkg", "conda-forge", "noarch", "1.0", 0),
+        ("dpkg", "conda-forge", "noarch", None, 0),
+        ("epkg", "conda-forge", "linux-ppc64le", "1.0", 0),
+    ]
+    frame = pd.DataFrame(
+        [(p, c, a, os.path.join(p, c, a, f"{p}-{v}-{n}.json"), v, n, str(n)) for p, c, a, v, n in rows],
+        columns=["pkg", "channel", "arch", "path", "version", "build_number", "build"],
+    )
+    latest = select_latest_artifacts(frame)
+    assert latest.to_dict() == {
+        "apkg": os.path.join("apkg", "conda-forge", "linux-64", "apkg-1.10-0.json"),
+        "cpkg": os.path.join("cpkg", "conda-forge", "osx-64", "cpkg-1.0-1.json"),
+        "dpkg": os.path.join("dpkg", "conda-forge", "noarch", "dpkg-1.0-0.json"),
+    }
+    latest = select_latest_artifacts(frame, channels=("bioconda", "conda-forge"), include_noarch=False)
+    assert latest.to_dict() == {
+        "apkg": os.path.join("apkg", "bioconda", "linux-64", "apkg-3.0-0.json"),
+        "bpkg": os.path.join("bpkg", "bioconda", "linux-64", "bpkg-3.0-0.json"),
+        "cpkg": os.path.join("cpkg", "conda-forge", "osx-64", "cpkg-1.0-1.json"),
+    }
+    assert select_latest_artifacts(frame, channels=("nochannel",)).empty
@@ -0,0 +1,115 @@
+"""Tests the binary channel graph format."""
+import os
+
+import networkx as nx
+import pytest
+
+from libcflib.csrgraph import CSRGraph, remove_csr_graph, write_csr_graph
+
+
+def make_graph():
+    g = nx.DiGraph()
+    g.add_node("python", archs={"linux-64", "osx-64"}, versions={"3.8"}, req={"zlib"})
+    g.add_node("numpy", archs={"linux-64", "osx-64"}, versions={"1.0"}, req={"python"})
+    g.add_node("scipy", archs={"linux-64"}, versions={"1.0"}, req={"python", "numpy"})
+    g.add_node("pkg-é", archs={"noarch"}, versions={"1.0"}, req={"python"})
+    g.add_edge("zlib", "python", arch={"linux-64", "osx-64"})
+    g.add_edge("python", "numpy", arch={"linux-64", "osx-64"})
+    g.add_edge("python", "scipy", arch={"linux-64"})
+    g.add_edge("numpy", "scipy", arch={"linux-64"})
+    g.add_edge("python", "pkg-é", arch={"noarch"})
+    return g
+
+
+def test_csr_graph(tmpdir):
+    dirname = str(tmpdir.join("conda-forge.csr"))
+    write_csr_graph(make_graph(), dirname)
+    g = CSRGraph(dirname)
+    assert len(g) == 5
+    assert g.n_edges == 5
+    assert list(g) == sorted(["numpy", "pkg-é", "python", "scipy", "zlib"])
+    assert g.arches == ["linux-64", "noarch", "osx-64"]
+    assert "pkg-é" in g
+    assert "nopkg" not in g
+    with pytest.raises(KeyError):
+        g.index("nopkg")
+    assert g.name(g.index("scipy")) == "scipy"
+    assert g.dependents("python") == ["numpy", "pkg-é", "scipy"]
+    assert g.dependents("python", arch="osx-64") == ["numpy"]
+    assert g.dependents("python", arch=["noarch", "osx-64"]) == ["numpy", "pkg-é"]
+    assert g.dependents("python", arch="win-64") == []
+    assert g.dependencies("scipy") == ["numpy", "python"]
+    assert g.dependencies(g.index("zlib")) == []
+    assert g.edge_arches("python", "numpy") == {"linux-64", "osx-64"}
+    assert g.edge_arches("numpy", "python") == set()
+    assert g.node_arches("scipy") == {"linux-64"}
+    assert g.node_arches("zlib") == set()
+
+    # rewriting replaces the graph, while the old one can still be read
+    h = make_graph()
+    h.remove_node("scipy")
+    write_csr_graph(h, dirname)
+    assert g.dependents("python") == ["numpy", "pkg-é", "scipy"]
+    assert CSRGraph(dirname).dependents("python") == ["numpy", "pkg-é"]
+    # the link is swapped, so the graph is always there, and the previous
+    # version is kept for readers that have just resolved the link
+    write_csr_graph(make_graph(), dirname)
+    assert os.readlink(dirname) == "conda-forge.csr.3"
+    assert sorted(os.listdir(str(tmpdir))) == ["conda-forge.csr", "conda-forge.csr.2", "conda-forge.csr.3"]
+    assert g.dependents("python") == ["numpy", "pkg-é", "scipy"]
+    assert CSRGraph(dirname).dependents("python") == ["numpy", "pkg-é", "scipy"]
+    remove_csr_graph(dirname)
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_plain_csr_graph(tmpdir):
+    # graphs that were written as plain directories are moved aside once
+    dirname = str(tmpdir.join("conda-forge.csr"))
+    write_csr_graph(make_graph(), dirname)
+    os.rename(os.path.realpath(dirname), dirname + ".tmp")
+    os.remove(dirname)
+    os.rename(dirname + ".tmp", dirname)
+    write_csr_graph(make_graph(), dirname)
+    assert os.readlink(dirname) == "conda-forge.csr.1"
+    assert sorted(os.listdir(str(tmpdir))) == ["conda-forge.csr", "conda-forge.csr.0", "conda-forge.csr.1"]
+    assert len(CSRGraph(dirname)) == 5
+
+
+def test_empty_csr_graph(tmpdir):
+    dirname = str(tmpdir.join("empty.csr"))
+    write_csr_graph(nx.DiGraph(), dirname)
+    g = CSRGraph(dirname)
+    assert len(g) == 0
+    assert "python" not in g
+
+
+def test_graph_queries(tmpdir):
+    g = make_graph()
+    # a cycle, with a package that depends on it
+    g.add_edge("scipy", "cyc-a", arch={"linux-64"})
+    g.add_edge("cyc-a", "cyc-b", arch={"linux-64"})
+    g.add_edge("cyc-b", "cyc-a", arch={"linux-64"})
+    g.add_edge("cyc-b", "after-cyc", arch={"linux-64"})
+    dirname = str(tmpdir.join("conda-forge.csr"))
+    write_csr_graph(g, dirname)
+    g = CSRGraph(dirname).preload()
+    assert g.dependency_closure("scipy") == {"numpy": 1, "python": 1, "zlib": 2}
+    assert g.dependency_closure("scipy", max_depth=1) == {"numpy": 1, "python": 1}
+    assert g.dependency_closure("zlib") == {}
+    assert g.dependent_closure("python", arch="osx-64") == {"numpy": 1}
+    assert g.dependent_closure("python", max_depth=0) == {}
+    assert g.dependent_closure("zlib", max_depth=2) == {
+        "python": 1, "numpy": 2, "pkg-é": 2, "scipy": 2,
+    }
+    # results are cached
+    assert g.dependency_closure("scipy") is g.dependency_closure("scipy")
+    assert g.rebuild_order("python") == {
+        "stages": [["python"], ["numpy", "pkg-é"], ["scipy"]],
+        "cycles": ["after-cyc", "cyc-a", "cyc-b"],
+    }
+    assert g.rebuild_order("python", max_depth=1) == {
+        "stages": [["python"], ["numpy", "pkg-é"], ["scipy"]],
+        "cycles": [],
+    }
+    assert g.rebuild_order("zlib", max_depth=1) == {"stages": [["zlib"], ["python"]], "cycles": []}
+    assert g.rebuild_order("python", arch="noarch") == {"stages": [["python"], ["pkg-é"]], "cycles": []}
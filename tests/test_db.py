@@ -1,5 +1,11 @@
+import os
+import json
+import builtins
+import subprocess
+
 import pytest
 from libcflib import db
+from libcflib.indexer import ArtifactIndex, index
 
 
 @pytest.fixture(scope="session")
@@ -30,3 +36,225 @@ def test_search_pagenum(db_fixture, documents):
     exp = {db_fixture.get_artifact(path=documents[1]["path"])}
     assert len(obs) == 1
     assert obs == exp
+
+
+def test_search_cursor_needs_index(db_fixture, documents):
+    with pytest.raises(ValueError):
+        db_fixture.search_page("noarch", cursor="abc")
+
+
+def test_search_index(db_fixture, documents, tmpgraphdir, tmpdir):
+    filename = str(tmpdir.join("index.sqlite"))
+    index(os.path.join(tmpgraphdir, "artifacts"), filename=filename, max_workers=1)
+    db_fixture._index = ArtifactIndex(filename, readonly=True)
+    try:
+        exp = [db_fixture.get_artifact(path=doc["path"]) for doc in documents[:2]]
+        results, cursor = db_fixture.search_page("noarch", page_size=1)
+        assert results == exp[:1]
+        results, cursor = db_fixture.search_page("noarch", page_size=1, cursor=cursor)
+        assert results == exp[1:]
+        assert cursor is None
+        assert list(db_fixture.search("noarch", page_size=1, page_num=2)) == exp[1:]
+        assert len(list(db_fixture.search("mypkg"))) == 3
+        assert list(db_fixture.search("otherchannel linux-64")) == [
+            db_fixture.get_artifact(path=documents[2]["path"])
+        ]
+    finally:
+        db_fixture._index.close()
+        db_fixture._index = None
+
+
+def test_artifact_cache(db_fixture, documents):
+    db_fixture.invalidate()
+    path0, path1 = documents[0]["path"], documents[1]["path"]
+    before = db_fixture.cache_info()
+    a = db_fixture.get_artifact(path=path0)
+    assert db_fixture.get_artifact(path=path0) is a
+    info = db_fixture.cache_info()
+    assert info["misses"] == before["misses"] + 1
+    assert info["hits"] == before["hits"] + 1
+    assert info["entries"] == 1
+    assert info["nbytes"] == a._nbytes > 0
+    # once the cache is full, the least recently used artifacts are evicted
+    n = db_fixture.lru.n
+    db_fixture.lru.n = a._nbytes
+    try:
+        db_fixture.get_artifact(path=path1)
+        assert db_fixture.cache_info()["evictions"] == before["evictions"] + 1
+        assert db_fixture.get_artifact(path=path0) is not a
+    finally:
+        db_fixture.lru.n = n
+    db_fixture.update_graph()
+    assert db_fixture.cache_info()["entries"] == 0
+
+
+def test_parse_name_status():
+    out = "M\0artifacts/a/c/noarch/a-1.json\0A\0conda-forge.json\0D\0odd\tname\0"
+    assert db.parse_name_status(out) == [
+        ("M", "artifacts/a/c/noarch/a-1.json"),
+        ("A", "conda-forge.json"),
+        ("D", "odd\tname"),
+    ]
+
+
+def test_list_packages(tmpdir):
+    artifacts = tmpdir.mkdir("artifacts")
+    artifacts.mkdir("mypkg")
+    artifacts.mkdir(".packs")
+    artifacts.mkdir(".zstd-dicts")
+    artifacts.join("README").write("")
+    assert db.list_packages(str(artifacts)) == ["mypkg"]
+    tmpdir.join("conda-forge.json").write("{}")
+    tmpdir.join(".hidden.json").write("{}")
+    assert db.list_channel_graphs(str(tmpdir)) == ["conda-forge"]
+
+
+def git(*args, cwd):
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args),
+        cwd=cwd, check=True, capture_output=True,
+    )
+
+
+def write_json(filename, data):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as f:
+        json.dump(data, f)
+
+
+def test_update_graph_incremental(db_fixture, tmpdir):
+    env = builtins.__xonsh__.env
+    upstream, clone = str(tmpdir.join("upstream")), str(tmpdir.join("clone"))
+    noarch = os.path.join("artifacts", "mypkg", "conda-forge", "noarch")
+    apath = os.path.join("mypkg", "conda-forge", "noarch", "a.json")
+    bpath = os.path.join("mypkg", "conda-forge", "noarch", "b.json")
+    cpath = os.path.join("mypkg", "conda-forge", "noarch", "c.json")
+    write_json(os.path.join(upstream, noarch, "a.json"), {"v": 1})
+    write_json(os.path.join(upstream, noarch, "b.json"), {"v": 1})
+    write_json(os.path.join(upstream, "conda-forge.json"), {})
+    git("init", "-q", "-b", "master", cwd=upstream)
+    git("add", ".", cwd=upstream)
+    git("commit", "-q", "-m", "initial", cwd=upstream)
+    git("clone", "-q", upstream, clone, cwd=str(tmpdir))
+    keys = ["LIBCFGRAPH_DIR", "LIBCFGRAPH_URL", "LIBCFGRAPH_SNAPSHOTS"]
+    orig = {k: env.get(k) for k in keys}
+    orig_git = builtins.aliases.pop("git")
+    orig_repo_dir = db_fixture.repo_dir
+    env["LIBCFGRAPH_DIR"] = db_fixture.repo_dir = clone
+    env["LIBCFGRAPH_URL"] = upstream
+    env["LIBCFGRAPH_SNAPSHOTS"] = snapshots = str(tmpdir.join("snapshots"))
+    try:
+        db_fixture.commit = None
+        assert db_fixture.update_graph() == []
+        shared_index = str(tmpdir.join("index.sqlite"))
+        index(os.path.join(clone, "artifacts"), filename=shared_index, max_workers=1)
+        db_fixture._set_index_file(shared_index)
+        a = db_fixture.get_artifact(path=apath)
+        b = db_fixture.get_artifact(path=bpath)
+        write_json(os.path.join(upstream, noarch, "a.json"), {"v": 2})
+        git("commit", "-q", "-am", "update a", cwd=upstream)
+        changes = db_fixture.update_graph()
+        assert changes == [("M", "artifacts/mypkg/conda-forge/noarch/a.json")]
+        a = db_fixture.get_artifact(path=apath)
+        assert a["v"] == 2
+        assert db_fixture.get_artifact(path=bpath) is b
+
+        # updates from snapshots alternate between two worktrees
+        for v, snapshot_dir in [(3, "a"), (4, "b"), (5, "a")]:
+            write_json(os.path.join(upstream, noarch, "a.json"), {"v": v})
+            git("commit", "-q", "-am", f"update a to {v}", cwd=upstream)
+            cwd = os.getcwd()
+            snapshot = db_fixture.prepare_snapshot()
+            assert snapshot.path == os.path.join(snapshots, snapshot_dir)
+            # the working directory is shared with the threads serving requests
+            assert os.getcwd() == cwd
+            # nothing changes until the snapshot is swapped in
+            assert db_fixture.get_artifact(path=apath) is a
+            assert db_fixture.prepare_snapshot().commit == snapshot.commit
+            db_fixture.swap_snapshot(snapshot)
+            assert env.get("LIBCFGRAPH_DIR") == snapshot.path
+            assert snapshot.changes == [("M", "artifacts/mypkg/conda-forge/noarch/a.json")]
+            assert set(db_fixture.channel_graphs) == {"conda-forge"}
+            a = db_fixture.get_artifact(path=apath)
+            assert a["v"] == v
+            assert db_fixture.get_artifact(path=bpath) is b
+
+        # the package index is kept up to date with added and removed artifacts
+        assert db_fixture.package_index.get("mypkg") == {"conda-forge": {"noarch": {"a.json", "b.json"}}}
+        write_json(os.path.join(upstream, noarch, "c.json"), {"v": 1})
+        git("rm", "-q", os.path.join(noarch, "b.json"), cwd=upstream)
+        git("add", ".", cwd=upstream)
+        git("commit", "-q", "-m", "replace b with c", cwd=upstream)
+        snapshot = db_fixture.prepare_snapshot()
+        # the index being searched only changes when the snapshot is swapped in
+        assert set(db_fixture.index.summaries("mypkg")) == {apath, bpath}
+        db_fixture.swap_snapshot(snapshot)
+        assert db_fixture.index.filename == snapshot.index_file
+        assert set(db_fixture.index.summaries("mypkg")) == {apath, cpath}
+        # each snapshot index is stamped from its own worktree
+        ix = ArtifactIndex(snapshot.index_file)
+        try:
+            exp = {"indexed": 0, "removed": 0, "failed": 0}
+            assert ix.update(os.path.join(snapshot.path, "artifacts"), max_workers=1) == exp
+        finally:
+            ix.close()
+        ix = ArtifactIndex(shared_index)
+        try:
+            assert set(ix.summaries("mypkg")) == {apath, bpath}
+        finally:
+            ix.close()
+        assert db_fixture.package_index.get("mypkg") == {"conda-forge": {"noarch": {"a.json", "c.json"}}}
+        pkg = db_fixture.packages["mypkg"]
+        assert pkg.channels == {"conda-forge"}
+        assert pkg.artifacts == {"conda-forge": {"noarch": {"a.json", "c.json"}}}
+        assert db_fixture.prepare_snapshot() is None
+    finally:
+        builtins.aliases["git"] = orig_git
+        env.update(orig)
+        db_fixture.repo_dir = orig_repo_dir
+        db_fixture.commit = None
+        db_fixture._set_index_file(os.path.join(db_fixture._idx, "index.sqlite"))
+        db_fixture.invalidate()
+
+
+def test_latest_artifact(db_fixture, tmpdir):
+    env = builtins.__xonsh__.env
+    graph = str(tmpdir.join("graph"))
+    arts = os.path.join(graph, "artifacts")
+    write_json(os.path.join(graph, "conda-forge.json"), {})
+
+    def write_artifact(arch, version, build_number):
+        name = f"mypkg-{version}-{build_number}"
+        data = {"version": version, "index": {"build_number": build_number, "build": str(build_number)}}
+        write_json(os.path.join(arts, "mypkg", "conda-forge", arch, name + ".json"), data)
+        return os.path.join("mypkg", "conda-forge", arch, name + ".json")
+
+    write_artifact("noarch", "1.2.0", 0)
+    write_artifact("linux-64", "1.10.0", 0)
+    latest = write_artifact("linux-64", "1.10.0", 1)
+    write_artifact("osx-64", "3.0.0", 0)
+    filename = str(tmpdir.join("index.sqlite"))
+    index(arts, filename=filename, max_workers=1)
+    orig = env.get("LIBCFGRAPH_DIR")
+    env["LIBCFGRAPH_DIR"] = graph
+    db_fixture.invalidate()
+    try:
+        assert db_fixture.packages["mypkg"].latest_artifact()._path == latest
+        # with the index, only the latest artifact is loaded
+        db_fixture._index = ArtifactIndex(filename, readonly=True)
+        db_fixture.invalidate()
+        misses = db_fixture.cache_info()["misses"]
+        pkg = db_fixture.packages["mypkg"]
+        assert pkg.latest_artifact()._path == latest
+        # the package and the artifact
+        assert db_fixture.cache_info()["misses"] == misses + 2
+        # artifacts that have not been indexed yet are loaded
+        newer = write_artifact("noarch", "1.11.0", 0)
+        db_fixture.invalidate()
+        assert db_fixture.packages["mypkg"].latest_artifact()._path == newer
+    finally:
+        if db_fixture._index is not None:
+            db_fixture._index.close()
+            db_fixture._index = None
+        env["LIBCFGRAPH_DIR"] = orig
+        db_fixture.invalidate()
@@ -0,0 +1,70 @@
+"""Tests the REST handlers."""
+import os
+import json
+
+import networkx as nx
+import pytest
+import tornado.web
+from tornado.httpclient import HTTPError
+
+from libcflib.csrgraph import remove_csr_graph, write_csr_graph
+from libcflib.db import DB
+from libcflib.rest.handlers import Dependencies, Dependents, RebuildOrder
+
+APP = tornado.web.Application([(h.route, h) for h in [Dependencies, Dependents, RebuildOrder]])
+
+
+@pytest.fixture
+def app():
+    return APP
+
+
+@pytest.fixture
+def graph_db(tmpgraphdir):
+    g = nx.DiGraph()
+    g.add_edge("zlib", "python", arch={"linux-64", "osx-64"})
+    g.add_edge("python", "numpy", arch={"linux-64", "osx-64"})
+    g.add_edge("numpy", "scipy", arch={"linux-64"})
+    # only the binary graph is written, since the JSON is not needed
+    csr_dir = os.path.join(tmpgraphdir, "graphchannel.csr")
+    write_csr_graph(g, csr_dir)
+    db = DB()
+    db.invalidate()
+    yield db
+    remove_csr_graph(csr_dir)
+    db.invalidate()
+
+
+def fetch(http_client, base_url, path, **params):
+    return http_client.fetch(
+        base_url + path, body=json.dumps(params), method="GET", allow_nonstandard_methods=True
+    )
+
+
+@pytest.mark.gen_test
+def test_graph_queries(graph_db, http_client, base_url):
+    response = yield fetch(http_client, base_url, "/dependencies", pkg="scipy", channel="graphchannel")
+    res = json.loads(response.body)
+    assert res["dependencies"] == {"numpy": 1, "python": 2, "zlib": 3}
+    response = yield fetch(http_client, base_url, "/dependents", pkg="python", channel="graphchannel",
+                           depth=1, arch="osx-64,noarch")
+    assert json.loads(response.body)["dependents"] == {"numpy": 1}
+    response = yield fetch(http_client, base_url, "/rebuild-order", pkg="python", channel="graphchannel")
+    assert json.loads(response.body)["order"] == {"stages": [["python"], ["numpy"], ["scipy"]], "cycles": []}
+    for params in [{"pkg": "nopkg", "channel": "graphchannel"}, {"pkg": "python", "channel": "nochannel"}]:
+        with pytest.raises(HTTPError) as e:
+            yield fetch(http_client, base_url, "/dependencies", **params)
+        assert e.value.response.code == 404
+
+
+@pytest.mark.gen_test
+def test_graph_queries_without_json(graph_db, tmpgraphdir, http_client, base_url):
+    assert not os.path.exists(os.path.join(tmpgraphdir, "graphchannel.json"))
+    response = yield fetch(http_client, base_url, "/dependents", pkg="zlib", channel="graphchannel")
+    assert json.loads(response.body)["dependents"] == {"python": 1, "numpy": 2, "scipy": 3}
+    # the binary graph is cached on its own, weighed by its size
+    graph = graph_db.graph("graphchannel")
+    assert graph_db.lru[("csr_graph", "graphchannel")] is graph
+    assert ("channel_graph", "graphchannel") not in graph_db.lru
+    assert graph_db.lru.weights[("csr_graph", "graphchannel")] == graph.nbytes
+    assert graph_db.graph("../graphchannel") is None
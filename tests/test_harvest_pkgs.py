@@ -0,0 +1,59 @@
+"""Tests writing the channel graphs."""
+import os
+import json
+import builtins
+
+import pytest
+
+from libcflib import harvest_pkgs
+from libcflib.db import DB
+from libcflib.indexer import index
+
+
+def write_artifact(root, pkg, version, requirements):
+    path = os.path.join(pkg, "conda-forge", "noarch", f"{pkg}-{version}-0.json")
+    filename = os.path.join(root, path)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    data = {
+        "version": version,
+        "index": {"build_number": 0, "build": "0"},
+        "rendered_recipe": {"requirements": {"run": requirements}},
+    }
+    with open(filename, "w") as f:
+        json.dump(data, f)
+    return path
+
+
+@pytest.fixture
+def graph_dir(tmpdir, tmpgraphdir):
+    env = builtins.__xonsh__.env
+    db = DB()
+    orig_dir, orig_index_file = env.get("LIBCFGRAPH_DIR"), db.index_file
+    env["LIBCFGRAPH_DIR"] = d = str(tmpdir.join("graph"))
+    os.makedirs(os.path.join(d, "artifacts"))
+    filename = str(tmpdir.join("index.sqlite"))
+    index(os.path.join(d, "artifacts"), filename=filename, max_workers=1)
+    db._set_index_file(filename)
+    db.invalidate()
+    yield d
+    env["LIBCFGRAPH_DIR"] = orig_dir
+    db._set_index_file(orig_index_file)
+    db.invalidate()
+
+
+def test_latest_state_with_stale_index(graph_dir):
+    root = os.path.join(graph_dir, "artifacts")
+    a1 = write_artifact(root, "apkg", "1.0", ["python"])
+    b1 = write_artifact(root, "bpkg", "1.0", ["apkg"])
+    state = harvest_pkgs.create_latest_state(max_workers=1)
+    assert set(state.contributions) == {a1, b1}
+    # the index is not updated along with the artifacts
+    a2 = write_artifact(root, "apkg", "2.0", ["python", "zlib"])
+    c1 = write_artifact(root, "cpkg", "1.0", ["bpkg"])
+    os.remove(os.path.join(root, b1))
+    harvest_pkgs.update_latest_state(state, [a2, c1, b1], max_workers=1)
+    assert set(state.contributions) == {a2, c1}
+    assert state.digraph("conda-forge").nodes["apkg"]["req"] == {"python", "zlib"}
+    # nor is it for a full build
+    a3 = write_artifact(root, "apkg", "3.0", [])
+    assert set(harvest_pkgs.create_latest_state(max_workers=1).contributions) == {a3, c1}
@@ -0,0 +1,48 @@
+"""Tests the conda package harvester."""
+import os
+import json
+
+from libcflib.harvester import harvest, harvest_directory, harvest_from_filename
+
+
+def test_harvest_streaming(tmpdir, tarbz2_factory):
+    fname = tarbz2_factory(str(tmpdir), payload_size=10_000_000)
+    full_stats, stream_stats = {}, {}
+    with open(fname, "rb") as f:
+        exp = harvest(f, stats=full_stats)
+    with open(fname, "rb") as f:
+        obs = harvest(f, streaming=True, stats=stream_stats)
+    assert obs == exp
+    assert obs["name"] == "mypkg"
+    assert obs["files"] == ["site-packages/mypkg/__init__.py"]
+    assert full_stats["decompressed_bytes"] > 10_000_000
+    assert stream_stats["decompressed_bytes"] < 1_000_000
+
+
+def test_harvest_from_filename(tmpdir, tarbz2_factory):
+    fname = tarbz2_factory(str(tmpdir))
+    data = harvest_from_filename(fname)
+    assert data["version"] == "1.0"
+    assert data["conda_pkg_format"] is None
+
+
+def test_harvest_directory(tmpdir, tarbz2_factory):
+    mirror = tmpdir.mkdir("mirror")
+    tarbz2_factory(str(mirror.mkdir("noarch")), name="mypkg")
+    # a flat pkgs/ cache layout gets its subdir from the index
+    flat = tarbz2_factory(str(mirror), name="otherpkg", version="2.0")
+    output_dir = str(tmpdir.mkdir("artifacts"))
+    counts = harvest_directory(str(mirror), output_dir, channel="mychan", max_workers=2)
+    assert counts == {"harvested": 2, "skipped": 0, "failed": 0}
+    for path in [
+        "mypkg/mychan/noarch/mypkg-1.0-py_0.json",
+        "otherpkg/mychan/noarch/otherpkg-2.0-py_0.json",
+    ]:
+        with open(os.path.join(output_dir, path)) as f:
+            assert json.load(f)["files"] == ["site-packages/mypkg/__init__.py"]
+    # existing outputs are skipped without opening the packages, even in
+    # flat layouts
+    with open(flat, "wb") as f:
+        f.write(b"not a package")
+    counts = harvest_directory(str(mirror), output_dir, channel="mychan", max_workers=2)
+    assert counts == {"harvested": 0, "skipped": 2, "failed": 0}
@@ -0,0 +1,95 @@
+"""Tests the full-text artifact index."""
+import os
+import json
+
+import pytest
+
+from libcflib.indexer import ArtifactIndex, index, stored_fields
+
+
+def write_artifact(root, pkg, version, summary):
+    path = os.path.join(pkg, "conda-forge", "noarch", f"{pkg}-{version}-py_0.json")
+    filename = os.path.join(root, path)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    data = {
+        "name": pkg,
+        "about": {"summary": summary},
+        "index": {"name": pkg, "version": version, "depends": ["python"]},
+        "files": [f"site-packages/{pkg}/__init__.py"],
+    }
+    with open(filename, "w") as f:
+        json.dump(data, f)
+    return path
+
+
+def match(ix, query):
+    return sorted(
+        path
+        for (path,) in ix.conn.execute(
+            "SELECT docs.path FROM fts JOIN docs ON docs.id = fts.rowid "
+            "WHERE fts MATCH ?",
+            (query,),
+        )
+    )
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_index(tmpdir, max_workers):
+    root = str(tmpdir.mkdir("artifacts"))
+    filename = str(tmpdir.join("index.sqlite"))
+    a = write_artifact(root, "apkg", "1.0", "fast widgets")
+    b = write_artifact(root, "bpkg", "1.0", "slow gadgets")
+    c = write_artifact(root, "cpkg", "2.0", "gadgets for widgets")
+    obs = index(root, filename=filename, batch_size=2, max_workers=max_workers)
+    assert obs == {"indexed": 3, "removed": 0, "failed": 0}
+    # nothing changed, so nothing is indexed again
+    obs = index(root, filename=filename, max_workers=max_workers)
+    assert obs == {"indexed": 0, "removed": 0, "failed": 0}
+
+    os.remove(os.path.join(root, b))
+    write_artifact(root, "apkg", "1.0", "fast widgets and sprockets")
+    os.utime(os.path.join(root, a), (0, 12345))
+    d = write_artifact(root, "dpkg", "1.0", "not json")
+    with open(os.path.join(root, d), "w") as f:
+        f.write("{")
+    ix = ArtifactIndex(filename)
+    obs = ix.update(root, max_workers=max_workers)
+    assert obs == {"indexed": 1, "removed": 1, "failed": 1}
+    assert len(ix) == 2
+    assert match(ix, "widgets") == [a, c]
+    assert match(ix, "gadgets") == [c]
+    assert match(ix, "sprockets") == [a]
+    assert match(ix, "pkg:cpkg") == [c]
+    assert set(stored_fields()) == {"name", "index"}
+    assert ix.stored_data(c) == {
+        "name": "cpkg",
+        "index": {"name": "cpkg", "version": "2.0", "depends": ["python"]},
+    }
+    assert ix.summaries("cpkg") == {c: (None, None, None)}
+    assert ix.summaries("cpkg", "conda-forge", ["linux-64"]) == {}
+    assert sorted(ix.summary_frame()["path"]) == [a, c]
+    assert list(ix.summary_frame(["cpkg", "nopkg"])["path"]) == [c]
+    assert ix.summary_frame([]).empty
+    # updating only some paths
+    e = write_artifact(root, "epkg", "1.0", "sprockets")
+    os.remove(os.path.join(root, c))
+    assert ix.update(root, paths=[c, e], max_workers=1) == {"indexed": 1, "removed": 1, "failed": 0}
+    assert match(ix, "sprockets") == [a, e]
+    ix.close()
+
+
+def test_index_optimize(tmpdir, monkeypatch):
+    optimized = []
+    monkeypatch.setattr(ArtifactIndex, "optimize", lambda self: optimized.append(len(self)))
+    root = str(tmpdir.mkdir("artifacts"))
+    filename = str(tmpdir.join("index.sqlite"))
+    write_artifact(root, "apkg", "1.0", "fast widgets")
+    index(root, filename=filename, max_workers=1)
+    assert optimized == [1]
+    # incremental runs are left to the automatic merging
+    write_artifact(root, "bpkg", "1.0", "slow gadgets")
+    assert index(root, filename=filename, max_workers=1)["indexed"] == 1
+    assert optimized == [1]
+    write_artifact(root, "cpkg", "1.0", "gadgets for widgets")
+    index(root, filename=filename, max_workers=1, optimize=True)
+    assert optimized == [1, 3]
@@ -0,0 +1,56 @@
+"""Tests the manifest of harvested artifacts."""
+import os
+
+from libcflib.manifest import Manifest
+from libcflib.preloader import RepodataRecord, diff
+
+
+def make_tree(root, paths):
+    for path in paths:
+        filename = os.path.join(root, path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as f:
+            f.write("{}")
+
+
+def record(pkg, name, ext=".tar.bz2"):
+    dst = f"conda-forge/noarch/{name}.json"
+    return RepodataRecord(pkg, dst, f"https://x/conda-forge/noarch/{name}{ext}", 1, 1)
+
+
+def test_manifest(tmpdir):
+    root = str(tmpdir.mkdir("artifacts"))
+    make_tree(root, ["a/conda-forge/noarch/a-1-0.json", "b/conda-forge/noarch/b-1-0.json"])
+    m = Manifest(str(tmpdir.join("manifest.sqlite")), root=root)
+    assert list(m) == ["a/conda-forge/noarch/a-1-0.json", "b/conda-forge/noarch/b-1-0.json"]
+    m.add("c/conda-forge/noarch/c-1-0.json")
+    m.discard("a/conda-forge/noarch/a-1-0.json")
+    assert "c/conda-forge/noarch/c-1-0.json" in m
+    assert "a/conda-forge/noarch/a-1-0.json" not in m
+    assert len(m) == 2
+    m.close()
+    # reopening for the same root does not walk the tree again
+    m = Manifest(str(tmpdir.join("manifest.sqlite")), root=root)
+    assert len(m) == 2
+    m.rebuild(root)
+    assert len(m) == 2
+    assert "a/conda-forge/noarch/a-1-0.json" in m
+    m.close()
+
+
+def test_diff(tmpdir):
+    root = str(tmpdir.mkdir("artifacts"))
+    make_tree(root, ["a/conda-forge/noarch/a-1-0.json"])
+    m = Manifest(str(tmpdir.join("manifest.sqlite")), root=root)
+    upstream = [
+        record("a", "a-1-0"),
+        record("a", "a-2-0", ext=".conda"),
+        record("a", "a-2-0"),
+        record("b", "b-1-0", ext=".conda"),
+    ]
+    upstream += [record("c", f"c-{i}-0") for i in range(1000)]
+    obs = diff(root, manifest=m, upstream=upstream)
+    assert len(obs) == 1002
+    assert record("a", "a-2-0") in obs
+    assert record("b", "b-1-0", ext=".conda") in obs
+    m.close()
@@ -2,7 +2,10 @@ import os
 import json
 import builtins
 
-from libcflib.models import Artifact, Package
+import networkx as nx
+
+from libcflib.csrgraph import write_csr_graph
+from libcflib.models import Artifact, ChannelGraph, Package
 
 
 def test_artifact(tmpgraphdir):
@@ -38,4 +41,29 @@ def test_package(tmpgraphdir):
     assert exp == obs
 
 
+def test_channel_graph_csr(tmpgraphdir):
+    assert ChannelGraph("nochannel").csr is None
+    g = nx.DiGraph()
+    g.add_edge("python", "numpy", arch={"linux-64"})
+    write_csr_graph(g, os.path.join(tmpgraphdir, "csrchannel.csr"))
+    cg = ChannelGraph("csrchannel")
+    assert cg.csr.dependents("python") == ["numpy"]
+    assert cg.csr is cg.csr
+    # the JSON is not needed
+    assert not cg._loaded
+    cg._load()
+    assert cg._nbytes == cg.csr.nbytes
+    assert not cg._json_loaded
+    # until the node-link data is used
+    with open(os.path.join(tmpgraphdir, "csrchannel.json"), "w") as f:
+        json.dump({"directed": True, "nodes": [{"id": "python"}, {"id": "numpy"}]}, f)
+    try:
+        assert cg["directed"]
+        assert cg.name == "csrchannel"
+        assert cg._json_loaded
+        assert cg._nbytes > cg.csr.nbytes
+    finally:
+        os.remove(os.path.join(tmpgraphdir, "csrchannel.json"))
+
+
 # TODO: test feedstock
@@ -0,0 +1,36 @@
+"""Tests the package index."""
+import os
+
+from libcflib.package_index import PackageIndex
+
+
+def test_package_index(tmpdir):
+    paths = [
+        os.path.join("mypkg", "conda-forge", "noarch", "mypkg-1.0-0.json"),
+        os.path.join("mypkg", "conda-forge", "linux-64", "mypkg-1.0-0.json"),
+        os.path.join("other", "bioconda", "noarch", "other-2.0-0.json"),
+    ]
+    for path in paths:
+        tmpdir.join(path).write("{}", ensure=True)
+    tmpdir.join("other", "bioconda", "noarch", "other-1.0-0.json.zst").write(b"", ensure=True)
+    index = PackageIndex.from_dir(str(tmpdir))
+    assert set(index) == {"mypkg", "other"}
+    assert index.get("mypkg") == {
+        "conda-forge": {"noarch": {"mypkg-1.0-0.json"}, "linux-64": {"mypkg-1.0-0.json"}},
+    }
+    assert index.get("other") == {
+        "bioconda": {"noarch": {"other-1.0-0.json", "other-2.0-0.json"}},
+    }
+    assert index.get("nopkg") == {}
+    # copies are returned
+    index.get("mypkg")["conda-forge"]["noarch"].clear()
+    assert index.get("mypkg")["conda-forge"]["noarch"] == {"mypkg-1.0-0.json"}
+
+    index.discard(paths[0])
+    assert index.get("mypkg") == {"conda-forge": {"linux-64": {"mypkg-1.0-0.json"}}}
+    index.discard(paths[1])
+    assert "mypkg" not in index
+    index.discard(paths[1])
+    index.add(paths[0])
+    assert index.get("mypkg") == {"conda-forge": {"noarch": {"mypkg-1.0-0.json"}}}
+    assert len(index) == 2
@@ -0,0 +1,80 @@
+"""Tests the packed artifact store."""
+import os
+import json
+
+from libcflib import store
+from libcflib.packstore import PackStore
+
+ARTIFACTS = {
+    os.path.join("a", "conda-forge", "noarch", "a-1-0.json"): {"name": "a", "version": "1"},
+    os.path.join("a", "conda-forge", "noarch", "a-2-0.json"): {"name": "a", "version": "2"},
+    os.path.join("b", "conda-forge", "linux-64", "b-1-0.json"): {"name": "b", "version": "1"},
+}
+
+
+def make_tree(root):
+    for path, data in ARTIFACTS.items():
+        filename = os.path.join(root, path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as f:
+            json.dump(data, f, indent=1)
+
+
+def test_pack_directory(tmpdir):
+    root = str(tmpdir)
+    make_tree(root)
+    packs = PackStore(root, n_shards=2)
+    assert packs.pack_directory(remove=True) == 3
+    assert sorted(packs.keys()) == sorted(ARTIFACTS)
+    for path, data in ARTIFACTS.items():
+        assert not os.path.exists(os.path.join(root, path))
+        assert packs.load(path) == data
+    assert packs.load(os.path.join("a", "conda-forge", "noarch", "a-3-0.json")) is None
+    # a reader that was opened earlier sees artifacts appended later
+    reader = PackStore(root)
+    path = os.path.join("c", "conda-forge", "noarch", "c-1-0.json")
+    with packs.writer() as w:
+        w.add(path, {"name": "c"})
+        # and rewritten ones replace the old
+        w.add(os.path.join("a", "conda-forge", "noarch", "a-1-0.json"), {"name": "a2"})
+    assert reader.load(path) == {"name": "c"}
+    assert reader.load(os.path.join("a", "conda-forge", "noarch", "a-1-0.json")) == {"name": "a2"}
+    assert len(reader) == 4
+
+
+def test_pack_directory_again(tmpdir):
+    root = str(tmpdir)
+    make_tree(root)
+    packs = PackStore(root, n_shards=2)
+    assert packs.pack_directory() == 3
+
+    def sizes():
+        return {p: os.path.getsize(packs.pack_file(p)) for p in range(packs.n_shards)
+                if os.path.exists(packs.pack_file(p))}
+
+    before = sizes()
+    assert packs.pack_directory() == 0
+    assert sizes() == before
+    assert len(packs) == 3
+    # but files that have changed since they were packed are appended
+    path = os.path.join("a", "conda-forge", "noarch", "a-1-0.json")
+    with open(os.path.join(root, path), "w") as f:
+        json.dump({"name": "a", "version": "1.1"}, f)
+    assert packs.pack_directory(remove=True) == 1
+    assert packs.load(path) == {"name": "a", "version": "1.1"}
+    assert len(packs) == 3
+
+
+def test_load_artifact(tmpdir):
+    root = str(tmpdir)
+    make_tree(root)
+    PackStore(root).pack_directory()
+    loose = os.path.join("d", "conda-forge", "noarch", "d-1-0.json")
+    os.makedirs(os.path.join(root, os.path.dirname(loose)))
+    with open(os.path.join(root, loose), "w") as f:
+        json.dump({"name": "d"}, f)
+    assert store.load_artifact(root, loose) == {"name": "d"}
+    for path, data in ARTIFACTS.items():
+        os.remove(os.path.join(root, path))
+        assert store.load_artifact(root, path) == data
+    assert sorted(store.iter_artifact_paths(root)) == sorted(list(ARTIFACTS) + [loose])
@@ -0,0 +1,113 @@
+"""Tests the artifact preloader (reaper)."""
+import os
+import bz2
+import json
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+from conda_package_streaming.transmute import transmute
+
+from libcflib.preloader import (
+    ReapFailure,
+    TransientReapFailure,
+    fetch_and_harvest,
+    fetch_upstream,
+    reap_async,
+    reap_package,
+)
+
+
+def test_fetch_and_harvest_tarbz2(pkg_server, tarbz2_factory):
+    d, url = pkg_server
+    fname = tarbz2_factory(str(d), payload_size=1_000_000)
+    data = fetch_and_harvest(url + "/" + os.path.basename(fname))
+    assert data["name"] == "mypkg"
+    assert data["conda_pkg_format"] is None
+
+
+def test_fetch_and_harvest_conda(pkg_server, tarbz2_factory, tmpdir):
+    d, url = pkg_server
+    fname = tarbz2_factory(str(tmpdir))
+    conda_fname = transmute(fname, str(d))
+    data = fetch_and_harvest(url + "/" + os.path.basename(conda_fname), spool_size=10)
+    assert data["name"] == "mypkg"
+    assert data["conda_pkg_format"] == "2"
+
+
+def test_reap_package(pkg_server, tarbz2_factory, tmpdir):
+    d, url = pkg_server
+    fname = tarbz2_factory(str(d))
+    root = str(tmpdir.mkdir("artifacts"))
+    dst = os.path.join("conda-forge", "noarch", "mypkg-1.0-py_0.json")
+    data = reap_package(root, "mypkg", dst, url + "/" + os.path.basename(fname))
+    assert data["path"] == os.path.join("mypkg", dst)
+    with open(os.path.join(root, "mypkg", dst)) as f:
+        assert json.load(f)["version"] == "1.0"
+
+
+def test_reap_async(pkg_server, transient_failures, tarbz2_factory, tmpdir):
+    d, url = pkg_server
+    artifacts = []
+    for name in ["apkg", "bpkg", "cpkg"]:
+        fname = os.path.basename(tarbz2_factory(str(d), name=name))
+        dst = os.path.join("conda-forge", "noarch", fname[:-8] + ".json")
+        artifacts.append((name, dst, url + "/" + fname))
+    transient_failures["/bpkg-1.0-py_0.tar.bz2"] = 2
+    artifacts.append(("missing", "conda-forge/noarch/missing.json", url + "/missing.tar.bz2"))
+    root = str(tmpdir.mkdir("artifacts"))
+    done = []
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        failures = asyncio.run(
+            reap_async(
+                root,
+                artifacts,
+                executor=pool,
+                concurrency=2,
+                per_host=1,
+                backoff=0.01,
+                callback=lambda artifact, exc: done.append(artifact[0]),
+            )
+        )
+    assert sorted(done) == ["apkg", "bpkg", "cpkg", "missing"]
+    assert len(failures) == 1
+    assert type(failures[0]) is ReapFailure
+    assert failures[0].args[1].endswith("missing.tar.bz2")
+    for name, dst, _ in artifacts[:3]:
+        assert os.path.isfile(os.path.join(root, name, dst))
+
+
+def test_reap_async_gives_up(pkg_server, transient_failures, tarbz2_factory, tmpdir):
+    d, url = pkg_server
+    fname = os.path.basename(tarbz2_factory(str(d)))
+    transient_failures["/" + fname] = 10
+    artifacts = [("mypkg", "conda-forge/noarch/mypkg.json", url + "/" + fname)]
+    root = str(tmpdir.mkdir("artifacts"))
+    failures = asyncio.run(reap_async(root, artifacts, retries=2, backoff=0.01))
+    assert len(failures) == 1
+    assert isinstance(failures[0], TransientReapFailure)
+    assert transient_failures["/" + fname] == 7
+
+
+def test_fetch_upstream(pkg_server, tmpdir):
+    d, url = pkg_server
+    channel = d.mkdir("conda-forge")
+    for arch in ["noarch", "linux-64"]:
+        repodata = {
+            "packages": {
+                f"mypkg-1.0-{arch}_0.tar.bz2": {"name": "mypkg", "size": 1},
+                "otherpkg-2.0-0.tar.bz2": {"name": "otherpkg", "size": 2},
+            },
+            "packages.conda": {
+                "otherpkg-2.0-0.conda": {"name": "otherpkg", "size": 3},
+            },
+        }
+        with open(str(channel.mkdir(arch).join("repodata.json.bz2")), "wb") as f:
+            f.write(bz2.compress(json.dumps(repodata).encode()))
+    channels = [f"{url}/conda-forge/noarch", f"{url}/conda-forge/linux-64"]
+    obs = fetch_upstream(channels, cache_dir=str(tmpdir.join("cache")))
+    assert set(obs) == {"mypkg", "otherpkg"}
+    assert len(obs["mypkg"]) == 2
+    # the .tar.bz2 artifacts win over the .conda ones with the same name
+    rec = obs["otherpkg"][f"{url}/conda-forge/noarch/otherpkg-2.0-0.json"]
+    assert rec.url.endswith("noarch/otherpkg-2.0-0.tar.bz2")
+    assert rec.size == 2
@@ -0,0 +1,97 @@
+"""Tests the repodata streaming and caching."""
+import io
+import os
+import bz2
+import json
+
+import pytest
+
+from libcflib.repodata import RepodataCache, iter_repodata, zstd
+
+REPODATA = {
+    "info": {"subdir": "noarch"},
+    "packages": {
+        "mypkg-1.0-py_0.tar.bz2": {"name": "mypkg", "size": 10, "timestamp": 1},
+        "odd-é-\"quoted\"-0.tar.bz2": {
+            "name": "odd",
+            "depends": ["python >=3.6", "{not an object}"],
+            "size": 1234567890,
+            "timestamp": 1600000000000,
+        },
+    },
+    "packages.conda": {
+        "mypkg-1.0-py_0.conda": {"name": "mypkg", "size": 8, "timestamp": 1},
+    },
+    "removed": ["gone-1.0-0.tar.bz2"],
+    "repodata_version": 1,
+}
+
+ENTRIES = [
+    ("mypkg-1.0-py_0.tar.bz2", "mypkg", 10, 1),
+    ("odd-é-\"quoted\"-0.tar.bz2", "odd", 1234567890, 1600000000000),
+    ("mypkg-1.0-py_0.conda", "mypkg", 8, 1),
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 2**16])
+@pytest.mark.parametrize("indent", [None, 1])
+def test_iter_repodata(chunk_size, indent):
+    text = io.StringIO(json.dumps(REPODATA, indent=indent))
+    obs = list(iter_repodata(text, chunk_size=chunk_size))
+    exp = [
+        (key, fn, info)
+        for key in ["packages", "packages.conda"]
+        for fn, info in REPODATA[key].items()
+    ]
+    assert obs == exp
+
+
+def write_bz2(subdir):
+    fname = str(subdir.join("repodata.json.bz2"))
+    with open(fname, "wb") as f:
+        f.write(bz2.compress(json.dumps(REPODATA).encode()))
+    return fname
+
+
+def test_conditional_fetch(pkg_server, tmpdir):
+    d, url = pkg_server
+    fname = write_bz2(d.mkdir("noarch"))
+    cache = RepodataCache(str(tmpdir.join("cache")))
+    cache.formats = (".bz2",)
+    meta = cache.update(url + "/noarch")
+    assert meta["packages"] == 2
+    assert meta["packages.conda"] == 1
+    assert list(cache.entries(url + "/noarch")) == ENTRIES
+    # corrupt the upstream file without changing its mtime, the server says
+    # it is not modified, and so the cached repodata is used.
+    stat = os.stat(fname)
+    with open(fname, "wb") as f:
+        f.write(b"not bz2")
+    os.utime(fname, (stat.st_atime, stat.st_mtime))
+    assert cache.update(url + "/noarch") == meta
+    assert list(cache.entries(url + "/noarch")) == ENTRIES
+    # now it actually changes
+    os.utime(fname, (stat.st_atime, stat.st_mtime + 10))
+    with pytest.raises(OSError):
+        cache.update(url + "/noarch")
+
+
+@pytest.mark.skipif(zstd is None, reason="zstd is not available")
+def test_prefers_zst(pkg_server, tmpdir):
+    d, url = pkg_server
+    subdir = d.mkdir("noarch")
+    with open(str(subdir.join("repodata.json.bz2")), "wb") as f:
+        f.write(b"not bz2")
+    with open(str(subdir.join("repodata.json.zst")), "wb") as f:
+        f.write(zstd.compress(json.dumps(REPODATA).encode()))
+    cache = RepodataCache(str(tmpdir.join("cache")))
+    cache.update(url + "/noarch")
+    assert list(cache.entries(url + "/noarch")) == ENTRIES
+
+
+def test_falls_back_to_bz2(pkg_server, tmpdir):
+    d, url = pkg_server
+    write_bz2(d.mkdir("noarch"))
+    cache = RepodataCache(str(tmpdir.join("cache")))
+    cache.update(url + "/noarch")
+    assert list(cache.entries(url + "/noarch")) == ENTRIES
@@ -0,0 +1,57 @@
+"""Tests reading and writing compressed artifacts."""
+import os
+import json
+
+import pytest
+
+from libcflib import store
+from libcflib.import_to_pkg import get_imports_and_files
+from libcflib.walker import walk_artifact_paths
+
+pytestmark = pytest.mark.skipif(store.zstd is None, reason="zstd is not available")
+
+
+def make_artifacts(root, n=50):
+    paths = []
+    for i in range(n):
+        path = os.path.join(f"pkg{i}", "conda-forge", "noarch", f"pkg{i}-1.{i}-py_0.json")
+        data = {
+            "name": f"pkg{i}",
+            "version": f"1.{i}",
+            "files": [f"site-packages/pkg{i}/__init__.py"]
+            + [f"site-packages/pkg{i}/mod{j}.py" for j in range(20)],
+        }
+        filename = os.path.join(root, path)
+        os.makedirs(os.path.dirname(filename))
+        store.dump_artifact(data, filename)
+        paths.append(path)
+    return paths
+
+
+def test_compressed_artifacts(tmpdir):
+    root = str(tmpdir.mkdir("artifacts"))
+    paths = make_artifacts(root)
+    plain = {p: store.load_artifact(root, p) for p in paths}
+    zstd_dict = store.train_dictionary(root, dict_size=4096, seed=42)
+    assert store.current_dictionary(root).dict_id == zstd_dict.dict_id
+    assert store.compress_directory(root) == len(paths)
+    assert not os.path.exists(os.path.join(root, paths[0]))
+    assert os.path.exists(os.path.join(root, paths[0] + ".zst"))
+    assert sorted(walk_artifact_paths(root)) == sorted(paths)
+    # read back in a fresh process, which has to find the dictionary
+    store.DICTIONARIES.clear()
+    for p in paths:
+        assert store.load_artifact(root, p) == plain[p]
+    imports, files = get_imports_and_files(os.path.join(root, paths[1]))
+    assert imports == {"pkg1"} | {f"pkg1.mod{j}" for j in range(20)}
+    assert files == plain[paths[1]]["files"]
+
+
+def test_dump_artifact_without_dictionary(tmpdir):
+    root = str(tmpdir)
+    path = os.path.join("a", "conda-forge", "noarch", "a-1-0.json")
+    os.makedirs(os.path.join(root, os.path.dirname(path)))
+    store.dump_artifact({"name": "a"}, os.path.join(root, path), compress=True)
+    with open(os.path.join(root, path + ".zst"), "rb") as f:
+        assert json.loads(store.zstd.decompress(f.read())) == {"name": "a"}
+    assert store.load_artifact(root, path) == {"name": "a"}
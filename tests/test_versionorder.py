@@ -0,0 +1,92 @@
+"""Tests the conda version ordering."""
+import random
+
+import pytest
+
+from libcflib.versionorder import (
+    INVALID_KEY,
+    argsort_artifacts,
+    version_order_key,
+    version_ranks,
+)
+
+# the example from conda's VersionOrder docs, in order, with equal versions
+# grouped together
+ORDERED = [
+    ["0.4", "0.4.0"],
+    ["0.4.1.rc", "0.4.1.RC"],
+    ["0.4.1"],
+    ["0.5a1"],
+    ["0.5b3"],
+    ["0.5C1"],
+    ["0.5"],
+    ["0.9.6"],
+    ["0.960923"],
+    ["1.0"],
+    ["1.1dev1"],
+    ["1.1_"],
+    ["1.1a1"],
+    ["1.1.0dev1", "1.1.dev1"],
+    ["1.1.a1"],
+    ["1.1.0rc1"],
+    ["1.1.0", "1.1"],
+    ["1.1.0post1", "1.1.post1"],
+    ["1.1post1"],
+    ["1.9"],
+    ["1.10a1"],
+    ["1.10"],
+    ["1996.07.12"],
+    ["1!0.4.1"],
+    ["1!3.1.1.6"],
+    ["2!0.4.1"],
+]
+
+
+def test_version_order_key():
+    keys = [[version_order_key(v) for v in group] for group in ORDERED]
+    for group in keys:
+        assert len(set(group)) == 1
+    firsts = [group[0] for group in keys]
+    assert firsts == sorted(firsts)
+    assert len(set(firsts)) == len(firsts)
+    assert version_order_key("1.0-1") == version_order_key("1.0_1") == version_order_key("1.0.1")
+    assert version_order_key("1.0+2") > version_order_key("1.0+1") > version_order_key("1.0")
+
+
+def test_trailing_underscore():
+    # the underscore is part of the text of the last component
+    assert version_order_key("1.0.2k") < version_order_key("1.0.2k_") < version_order_key("1.0.2l")
+    assert version_order_key("1.1_") < version_order_key("1.1a1")
+    # so post_ is a plain string, not post
+    assert version_order_key("2.0post_") < version_order_key("2.0")
+    assert version_order_key("1._") == version_order_key("1.0_")
+
+
+def test_dashes():
+    # dashes are replaced in the whole version, local version included, as
+    # long as there are no underscores anywhere in it
+    assert version_order_key("1.0+a-b") == version_order_key("1.0+a_b") == version_order_key("1.0+a.b")
+    assert version_order_key("1.0_1-2") == INVALID_KEY
+
+
+@pytest.mark.parametrize("version", ["", "1..0", "1.0 beta", "a!1.0", "1.0+a+b", "+1", "1.0+"])
+def test_invalid(version):
+    assert version_order_key(version) == INVALID_KEY
+    assert version_order_key(version) < version_order_key("0")
+
+
+def test_version_ranks():
+    versions = [v for group in ORDERED for v in group]
+    shuffled = random.Random(42).sample(versions, len(versions))
+    ranks = dict(zip(shuffled, version_ranks(shuffled)))
+    exp = [i for i, group in enumerate(ORDERED) for _ in group]
+    assert [ranks[v] for v in versions] == exp
+
+
+def test_argsort_artifacts():
+    versions = ["1.10", "1.9", "1.10", "1.10a1", "1.10"]
+    build_numbers = [0, 5, 1, 9, 1]
+    builds = ["py_0", "py_5", "py_1", "py_9", "py_1"]
+    paths = ["a", "b", "d", "e", "c"]
+    order = argsort_artifacts(versions, build_numbers, builds, paths)
+    assert list(order) == [1, 3, 0, 4, 2]
@@ -0,0 +1,39 @@
+"""Tests the artifacts directory walker."""
+import os
+
+from libcflib.walker import walk_artifacts, walk_artifact_paths
+
+PATHS = [
+    "a/conda-forge/linux-64/a-1-0.json",
+    "a/conda-forge/noarch/a-2-0.json",
+    "b/conda-forge/osx-64/b-1-0.json",
+    "b/other/osx-64/b-1-1.json",
+]
+
+
+def make_tree(root, paths):
+    for path in paths:
+        filename = os.path.join(root, path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as f:
+            f.write("{}")
+
+
+def test_walk_artifacts(tmpdir):
+    root = str(tmpdir)
+    # things that are not artifacts
+    make_tree(root, PATHS + [
+        ".git/conda-forge/noarch/x-1-0.json",
+        "a/conda-forge/noarch/.hidden.json",
+        "a/conda-forge/noarch/notes.txt",
+        "a/toplevel.json",
+    ])
+    assert list(walk_artifact_paths(root)) == PATHS
+    assert list(walk_artifacts(root, packages=["b"], max_workers=1)) == [
+        ("b", "conda-forge", "osx-64", "b-1-0"),
+        ("b", "other", "osx-64", "b-1-1"),
+    ]
+    pkg, channel, arch, name, size, mtime = next(walk_artifacts(root, with_stat=True))
+    assert name == "a-1-0"
+    assert size == 2
+    assert mtime == os.path.getmtime(os.path.join(root, PATHS[0]))
@@ -0,0 +1,57 @@
+"""Tests the persistent reap work queue."""
+import pytest
+
+from libcflib.workqueue import WorkQueue
+
+RECORDS = [
+    ("a", "conda-forge/noarch/a-1-0.json", "https://x/a-1-0.tar.bz2", 30, 100),
+    ("b", "conda-forge/noarch/b-1-0.json", "https://x/b-1-0.tar.bz2", 10, 300),
+    ("c", "conda-forge/noarch/c-1-0.json", "https://x/c-1-0.tar.bz2", 20, 200),
+]
+
+
+@pytest.fixture
+def wq(tmpdir):
+    q = WorkQueue(str(tmpdir.join("queue.sqlite")))
+    yield q
+    q.close()
+
+
+@pytest.mark.parametrize(
+    "order, exp",
+    [
+        ("name", ["a", "b", "c"]),
+        ("smallest", ["b", "c", "a"]),
+        ("largest", ["a", "c", "b"]),
+        ("newest", ["b", "c", "a"]),
+        ("oldest", ["a", "c", "b"]),
+    ],
+)
+def test_claim_order(wq, order, exp):
+    assert wq.add(RECORDS) == 3
+    obs = [row[0] for row in wq.claim(3, order=order)]
+    assert obs == exp
+
+
+def test_resume(wq):
+    wq.add(RECORDS)
+    # re-adding queued artifacts is a no-op
+    assert wq.add(RECORDS) == 0
+    a, b = wq.claim(2)
+    wq.mark_done(a[2])
+    wq.mark_failed(b[2], "boom")
+    c, = wq.claim(10)
+    assert wq.counts() == {"pending": 0, "in-flight": 1, "done": 1, "failed": 1}
+    # the run crashes, and a new one opens the same queue
+    wq2 = WorkQueue(wq.filename)
+    assert wq2.recover() == 1
+    assert wq2.claim(10) == [c]
+    assert wq2.failures() == {b[2]: "boom"}
+    assert wq2.retry_failed() == 1
+    assert wq2.claim(10) == [b]
+    wq2.close()
+
+
+def test_bad_order(wq):
+    with pytest.raises(ValueError):
+        wq.claim(1, order="random")